@@ -22,6 +22,7 @@ import {Joystick} from "react-joystick-component";
 
 import './App.css';
 import VideoStreamControl from "./VideoStreamControl";
+import {decode_message, encode_action} from "./BinaryProtocol";
 
 
 class App extends React.Component {
@@ -39,6 +40,8 @@ class App extends React.Component {
             window_width: window.innerWidth,
             recording_video: false
         };
+        // Binary encoding negotiated with the server
+        this.binary = false;
     }
 
     handleWindowResize = () => {
@@ -60,6 +63,7 @@ class App extends React.Component {
         let ws_url = "ws://" + (window.location.port === "3000" ? "localhost:8080" : window.location.host) + "/ws/robot";
 
         var ws = new WebSocket(ws_url);
+        ws.binaryType = "arraybuffer";
         let that = this; // cache the this
         var connectInterval;
 
@@ -67,7 +71,10 @@ class App extends React.Component {
         ws.onopen = () => {
             console.log("Connected to robot websocket");
 
+            this.binary = false;
             this.setState({ ws: ws });
+            // Binary encoding of the frequent messages, e.g. the joystick moves
+            ws.send(JSON.stringify({topic: "protocol", message: {binary: true}}));
 
             that.timeout = 250; // reset timer to 250 on open of websocket connection
             clearTimeout(connectInterval); // clear Interval on on open of websocket connection
@@ -89,9 +96,15 @@ class App extends React.Component {
 
         ws.onmessage = evt => {
             // listen to data sent from the websocket server
-            var message = JSON.parse(evt.data);
-            if (message.topic === "status") {
+            var message = typeof evt.data === "string" ? JSON.parse(evt.data) : decode_message(evt.data);
+            if (message === null) {
+                console.log("Unknown binary message");
+            } else if (message.topic === "status") {
                 this.updateStatus(message.message)
+            } else if (message.topic === "camera_status") {
+                this.setState({robot_status: {...this.state.robot_status, camera: message.message}});
+            } else if (message.topic === "protocol") {
+                this.binary = message.message.binary;
             } else if (message.topic === "video") {
                 console.log(message)
                 this.setState({recording_video: message.message.status === "recording"})
@@ -125,7 +138,12 @@ class App extends React.Component {
     }
 
     send_action = (type, action, args={}) => {
-        this.send_json({topic: "robot", message: {type: type, action: action, args: args}});
+        const data = this.binary ? encode_action(type, action, args) : null;
+        if (data !== null) {
+            this.state.ws.send(data);
+        } else {
+            this.send_json({topic: "robot", message: {type: type, action: action, args: args}});
+        }
     }
 
     send_json = (json_data) => {
@@ -0,0 +1,51 @@
+// Compact encoding of the frequent messages of the robot websocket, same layouts as server/webserver/binary_protocol.py.
+// Each message starts with its id, followed by a fixed layout, little endian.
+
+const DRIVE_MOVE = 0x01;
+const DRIVE_STOP = 0x02;
+const CAMERA_SET_POSITION = 0x03;
+const CAMERA_STATUS = 0x81;
+const NO_DURATION = 0xFFFF;
+
+const char = (view, offset) => String.fromCharCode(view.getUint8(offset));
+
+// Binary message for a robot action, null if the action has no binary layout
+export function encode_action(type, action, args) {
+    if (type === "drive" && action === "move") {
+        const view = new DataView(new ArrayBuffer(16));
+        view.setUint8(0, DRIVE_MOVE);
+        view.setUint8(1, args.left_orientation.charCodeAt(0));
+        view.setUint8(2, args.left_speed);
+        view.setUint8(3, args.right_orientation.charCodeAt(0));
+        view.setUint8(4, args.right_speed);
+        view.setUint16(5, args.duration === null ? NO_DURATION : args.duration, true);
+        view.setFloat32(7, args.distance === null ? NaN : args.distance, true);
+        view.setFloat32(11, args.rotation === null ? NaN : args.rotation, true);
+        view.setUint8(15, args.auto_stop ? 1 : 0);
+        return view.buffer;
+    } else if (type === "drive" && action === "stop") {
+        return new Uint8Array([DRIVE_STOP]).buffer;
+    } else if (type === "camera" && action === "set_position") {
+        return new Uint8Array([CAMERA_SET_POSITION, args.position]).buffer;
+    }
+    return null;
+}
+
+// Binary message from the server to the message it stands for: {topic, message}
+export function decode_message(buffer) {
+    const view = new DataView(buffer);
+    if (view.getUint8(0) === CAMERA_STATUS) {
+        return {
+            topic: "camera_status",
+            message: {
+                status: char(view, 1) + char(view, 2),
+                streaming: view.getUint8(3) !== 0,
+                overlay: view.getUint8(4) !== 0,
+                selected_camera: char(view, 5) === "f" ? "front" : "back",
+                position: view.getUint8(6),
+                center_position: view.getUint8(7),
+            }
+        };
+    }
+    return null;
+}
@@ -0,0 +1,135 @@
+import React from "react";
+
+const HUD_COLOR = "#00ff00";
+const ALERT_COLOR = "#ff0000";
+const HUD_THICKNESS = 2;
+const FONT_SIZE = 22;
+
+// Draws the HUD from the telemetry sent with each frame, when the server does not draw it in the frames.
+// Positions are in pixels of the captured frame, the SVG is scaled with the image. With a crop (x, y, width, height in
+// % of the frame), only the region of interest is shown.
+class HUDOverlay extends React.Component {
+
+    text(key, x, y, content, anchor = "start", color = HUD_COLOR) {
+        return (
+            <text key={key} x={x} y={y} fill={color} stroke="none" fontSize={FONT_SIZE} fontFamily="sans-serif" textAnchor={anchor}>
+                {content}
+            </text>
+        )
+    }
+
+    navigation(telemetry) {
+        const {width, height, motor, state} = telemetry;
+        const radius = 30;
+        const center_x = width / 2;
+        const center_y = height / 2 + 30;
+        const path_bottom = 100;
+        const elements = [
+            // Visor
+            <line key="visor_v" x1={center_x} y1={center_y + radius + 10} x2={center_x} y2={center_y - radius - 10}/>,
+            <line key="visor_h" x1={center_x + radius + 10} y1={center_y} x2={center_x - radius - 10} y2={center_y}/>,
+            <circle key="visor" cx={center_x} cy={center_y} r={radius}/>,
+            // Path
+            <line key="path_left" x1={center_x} y1={center_y} x2={path_bottom} y2={height}/>,
+            <line key="path_right" x1={center_x} y1={center_y} x2={width - path_bottom} y2={height}/>,
+            // Speed bars
+            <rect key="left_bar" x={5} y={height - 450} width={40} height={400}/>,
+            <rect key="right_bar" x={width - 45} y={height - 450} width={40} height={400}/>,
+        ];
+        if (motor) {
+            for (const [side, x] of [["left", 5], ["right", width - 45]]) {
+                const duty = 2 * (motor[side].duty || 0);
+                elements.push(
+                    <rect key={side + "_duty"} x={x} y={height - 250 - Math.max(0, duty)} width={40}
+                          height={Math.abs(duty)} fill={HUD_COLOR}/>
+                );
+            }
+            elements.push(this.text("odo", 5, 5 + FONT_SIZE, `ODO: ${(motor.abs_distance / 1000).toFixed(2)} m`));
+            elements.push(this.text("left_rpm", 5, height - 15, `${motor.left.speed_rpm} RPM`));
+            elements.push(this.text("right_rpm", width - 5, height - 15, `${motor.right.speed_rpm} RPM`, "end"));
+        }
+        if (state) {
+            elements.push(this.text("state", width - 5, 5 + FONT_SIZE, state.toUpperCase().replaceAll("_", " "), "end"));
+        }
+        return elements;
+    }
+
+    radar(telemetry) {
+        const {width, height, motor} = telemetry;
+        const radius = 0.15 * width;
+        const elements = [radius, 2 * radius / 3, radius / 3].map((ring_radius, i) =>
+            <circle key={"ring_" + i} cx={width / 2} cy={height} r={ring_radius}/>
+        );
+        for (const angle of [-45, 0, 45]) {
+            const a = angle * Math.PI / 180;
+            elements.push(
+                <line key={"radar_" + angle} x1={width / 2} y1={height}
+                      x2={width / 2 + radius * Math.sin(a)} y2={height - radius * Math.cos(a)}/>
+            );
+        }
+        const us_distances = (motor && motor.us_distances) || [];
+        us_distances.forEach((distance, i) => {
+            if (distance === null || distance === undefined) {
+                return;
+            }
+            const normalized_distance = radius * distance / 0.5;
+            if (normalized_distance <= radius) {
+                const a = [-45, 0, 45][i] * Math.PI / 180;
+                elements.push(
+                    <circle key={"obstacle_" + i} cx={width / 2 + normalized_distance * Math.sin(a)}
+                            cy={height - normalized_distance * Math.cos(a)} r={4} stroke={ALERT_COLOR}/>
+                );
+            }
+        });
+        return elements;
+    }
+
+    handlers(telemetry) {
+        const width = telemetry.width;
+        const handlers = telemetry.handlers || {};
+        const elements = [];
+        if (handlers.battery && handlers.battery.level !== null) {
+            const level = handlers.battery.level;
+            elements.push(
+                this.text("battery", 5, 2 * (10 + FONT_SIZE), `BAT: ${level}%`, "start", level < 10 ? ALERT_COLOR : HUD_COLOR)
+            );
+        }
+        if (handlers.camera && handlers.camera.recording) {
+            elements.push(this.text("rec", width / 2, 5 + FONT_SIZE, "REC", "middle"));
+        }
+        if (handlers.face_detection) {
+            const [x, y, w, h] = handlers.face_detection.face;
+            elements.push(<rect key="face" x={x} y={y} width={w} height={h} stroke="#ffffff"/>);
+        }
+        if (handlers.qr_code) {
+            handlers.qr_code.codes.forEach((code, i) => {
+                elements.push(<polygon key={"qr_" + i} points={code.corners.map(c => c.join(",")).join(" ")}/>);
+                elements.push(this.text("qr_text_" + i, code.corners[0][0], code.corners[0][1] - 5, code.data));
+            });
+        }
+        return elements;
+    }
+
+    render() {
+        const telemetry = this.props.telemetry;
+        const [x, y, width, height] = this.props.crop || [0, 0, 100, 100];
+        const viewBox = [x * telemetry.width / 100, y * telemetry.height / 100, width * telemetry.width / 100,
+            height * telemetry.height / 100];
+        return (
+            <svg
+                viewBox={viewBox.join(" ")}
+                preserveAspectRatio="none"
+                stroke={HUD_COLOR}
+                strokeWidth={HUD_THICKNESS}
+                fill="none"
+                style={{position: "absolute", top: 0, left: 0, width: "100%", height: "100%", pointerEvents: "none"}}
+            >
+                {telemetry.navigation && this.navigation(telemetry)}
+                {this.radar(telemetry)}
+                {this.handlers(telemetry)}
+            </svg>
+        )
+    }
+}
+
+export default HUDOverlay;
@@ -1,6 +1,9 @@
 import React from "react";
+import HUDOverlay from "./HUDOverlay";
 
 const FPS_UPDATE_INTERVAL = 1;
+// Sequence (uint32) and capture timestamp (float64) of the frame, little endian
+const FRAME_HEADER_SIZE = 12;
 
 class VideoStreamControl extends React.Component {
 
@@ -8,16 +11,33 @@ class VideoStreamControl extends React.Component {
         super(props);
         this.state = {
             frame: null,
+            telemetry: null,
         };
         this.ws = null
         this.frame_counter = 0
         this.last_frame_ts = 0
         this.slow_mode = false
+        this.pending_telemetry = null
+        // Received and display times of the last displayed frame, reported to the server with the next "ready"
+        this.last_displayed = null
     }
 
     start_streaming = (ws) => {
         console.log("Start streaming")
-        ws.send("start")
+        // Telemetry of the frames, to draw the HUD when the server does not draw it, and frame headers to report the
+        // latency
+        ws.send(JSON.stringify({action: "start", telemetry: true, header: true, ...this.get_roi()}))
+    }
+
+    // Region of interest to zoom on, props.roi: {crop: [x, y, width, height] in % of the frame, size: [width, height]}
+    get_roi = () => {
+        return this.props.roi ? {crop: this.props.roi.crop, size: this.props.roi.size} : {crop: null};
+    }
+
+    componentDidUpdate(prevProps) {
+        if (JSON.stringify(prevProps.roi) !== JSON.stringify(this.props.roi) && this.ws !== null) {
+            this.ws.send(JSON.stringify({action: "roi", ...this.get_roi()}));
+        }
     }
 
     componentDidMount() {
@@ -51,7 +71,12 @@ class VideoStreamControl extends React.Component {
 
         ws.onmessage = evt => {
             // listen to data sent from the websocket server
-            this.new_frame(evt.data);
+            if (typeof evt.data === "string") {
+                // Telemetry of the next frame
+                this.pending_telemetry = JSON.parse(evt.data);
+            } else {
+                this.new_frame(evt.data, Date.now() / 1000);
+            }
         }
 
         // websocket onclose event listener
@@ -88,7 +113,7 @@ class VideoStreamControl extends React.Component {
         if (!ws || ws.readyState === WebSocket.CLOSED) this.connect(); //check if websocket instance is closed, if so call `connect` function.
     };
 
-    new_frame = async (frame) => {
+    new_frame = async (frame, received_ts) => {
         this.frame_counter += 1;
         var now = Date.now() / 1000;
         if (now - this.last_frame_ts > FPS_UPDATE_INTERVAL) {
@@ -96,10 +121,19 @@ class VideoStreamControl extends React.Component {
             this.frame_counter = 0;
             this.last_frame_ts = now;
         }
+        const data = await frame.arrayBuffer();
+        const sequence = new DataView(data, 0, FRAME_HEADER_SIZE).getUint32(0, true);
         if (this.ws !== null) {
-            this.ws.send("ready");
+            this.ws.send(JSON.stringify({action: "ready", sequence: sequence, displayed: this.last_displayed}));
         }
-        this.setState({frame: await frame.arrayBuffer()});
+        const telemetry = this.pending_telemetry;
+        this.pending_telemetry = null;
+        this.setState({frame: data.slice(FRAME_HEADER_SIZE), telemetry: telemetry}, () => {
+            // Displayed with the next paint
+            window.requestAnimationFrame(() => {
+                this.last_displayed = {sequence: sequence, received_ts: received_ts, display_ts: Date.now() / 1000};
+            });
+        });
     }
 
     render() {
@@ -118,13 +152,17 @@ class VideoStreamControl extends React.Component {
             source = `data:image/jpg;base64,${base64String}`;
         }
         return (
-            <img
-                src={source}
-                style={{maxHeight: this.props.max_height, maxWidth: this.props.max_width}}
-                alt="Camera Feed"
-                onMouseMove={this.props.onMouseMove}
-                onClick={this.props.onClick}
-            />
+            <div style={{position: "relative", display: "inline-block", lineHeight: 0}}>
+                <img
+                    src={source}
+                    style={{maxHeight: this.props.max_height, maxWidth: this.props.max_width}}
+                    alt="Camera Feed"
+                    onMouseMove={this.props.onMouseMove}
+                    onClick={this.props.onClick}
+                />
+                {this.state.telemetry !== null &&
+                    <HUDOverlay telemetry={this.state.telemetry} crop={this.props.roi ? this.props.roi.crop : null}/>}
+            </div>
         )
     }
 }
@@ -0,0 +1,119 @@
+import asyncio
+import logging
+import threading
+import time
+
+from camera import Camera
+from handlers.base import BaseHandler
+from models import Config
+from motor.motor import Motor
+from prettytable import PrettyTable
+from server import Server
+from uart import UART
+from video.media_writer import MediaWriter
+from video.stats import pipeline_stats
+from video.vision import VisionExecutor
+
+logger = logging.getLogger(__name__)
+
+# Time given to the pipeline to reach its steady state before measuring
+WARMUP_DURATION = 2.0
+
+
+class TierViewer(object):
+    # Stream subscriber counting the frames delivered for a tier, like a viewer that never falls behind
+
+    def __init__(self, tier):
+        self.tier = tier
+        self.nb_of_frames = 0
+        self.nb_of_bytes = 0
+        self.lock = threading.Lock()
+
+    def new_frame(self, encoded_frame):
+        with self.lock:
+            self.nb_of_frames += 1
+            self.nb_of_bytes += len(encoded_frame.data)
+
+    def reset(self):
+        with self.lock:
+            self.nb_of_frames = 0
+            self.nb_of_bytes = 0
+
+
+def run_benchmark(device, source, duration, frame_rate, resolution, hud, tiers, handlers):
+    # Run the camera pipeline with the real handlers on replayed or synthetic frames and report the time spent in each
+    # stage. The settings are only overridden for this process, the saved configuration is left untouched.
+    Config.override("front_capturing_device", device)
+    Config.override("robot_has_back_camera", False)
+    if source is not None:
+        Config.override("capturing_replay_source", source)
+    if frame_rate is not None:
+        Config.override("capturing_framerate", frame_rate)
+    if resolution is not None:
+        Config.override("front_capturing_resolution", resolution)
+    if hud is not None:
+        Config.override("video_hud", hud)
+
+    server = Server()
+    UART.open()
+    Motor.setup()
+    Camera.setup()
+    VisionExecutor.setup(Config.get("vision_workers"))
+    MediaWriter.setup(Config.get("video_writer_queue_size"))
+    for handler in BaseHandler.handlers.values():
+        handler.setup(server)
+    for name in handlers:
+        handler = BaseHandler.get_handler(name)
+        if handler is None or not handler.eligible:
+            print(f"Unknown or not eligible handler {name}")
+            return
+        asyncio.run(handler.process(dict(type=name, action="start"), None))
+
+    viewers = [TierViewer(tier) for tier in tiers]
+    for i, viewer in enumerate(viewers):
+        Camera.add_new_streaming_frame_callback(f"benchmark_{i}", viewer.new_frame, viewer.tier)
+
+    Camera.start_continuous_capture()
+    time.sleep(WARMUP_DURATION)
+    pipeline_stats.reset()
+    for viewer in viewers:
+        viewer.reset()
+    start = time.monotonic()
+    time.sleep(duration)
+    elapsed = time.monotonic() - start
+    stages = pipeline_stats.serialize()
+    capture = Camera.scheduler.serialize() if Camera.scheduler is not None else {}
+    Camera.capturing = False
+    Camera.capturing_thread.join()
+    for i in range(len(viewers)):
+        Camera.remove_new_streaming_frame_callback(f"benchmark_{i}")
+
+    print(f"Capture: {capture.get('fps')} fps (target {capture.get('target_fps')}), jitter {capture.get('jitter_ms')} ms")
+    table = PrettyTable()
+    table.field_names = ["Stage", "Count", "Mean (ms)", "P50 (ms)", "P95 (ms)", "Max (ms)"]
+    table.align = "r"
+    table.align["Stage"] = "l"
+    for stage, stage_stats in stages.items():
+        table.add_row([
+            stage,
+            stage_stats["count"],
+            stage_stats["mean_ms"],
+            stage_stats["p50_ms"],
+            stage_stats["p95_ms"],
+            stage_stats["max_ms"],
+        ])
+    print(table)
+    table = PrettyTable()
+    table.field_names = ["Tier", "Frames", "FPS", "Avg size (KB)"]
+    table.align = "r"
+    table.align["Tier"] = "l"
+    for viewer in viewers:
+        table.add_row([
+            viewer.tier,
+            viewer.nb_of_frames,
+            round(viewer.nb_of_frames / elapsed, 2),
+            round(viewer.nb_of_bytes / viewer.nb_of_frames / 1000, 1) if viewer.nb_of_frames > 0 else None,
+        ])
+    print(table)
+    print(f"Encoder dropped frames: {Camera.encoder.serialize()['dropped_frames']}")
+    print(f"Scene: {Camera.scene_detector.serialize()}")
@@ -1,7 +1,6 @@
 import cv2
 import logging
 import numpy as np
-import math
 import platform
 import threading
 import time
@@ -11,6 +10,13 @@ from handlers.base import BaseHandler
 from models import Config
 from motor.motor import Motor
 from servo.servo_handler import ServoHandler
+from video.frame import FrameRing, get_jpeg_shape
+from video.encoder import DEFAULT_TIER, EncodingTier, FrameEncoder
+from video.hud import HUD_MODE_CLIENT, HUD_MODE_SERVER, HUDCompositor
+from video.scene import SceneChangeDetector
+from video.scheduler import CaptureScheduler
+from video.sources import ReplaySource, SyntheticSource
+from video.stats import pipeline_stats
 
 if platform.machine() == "aarch":  # Raspberry 32 bits
     import picamera
@@ -36,6 +42,53 @@ poly_coefficients = np.polyfit(reference['y_pos'], alpha, 3)
 max_y_pos = 42
 
 
+class FloorProjection(object):
+    # Lookup table mapping every pixel of a given resolution to its position on the floor (x, y in m), computed once
+    # with the calibration model above
+    projections = {}
+    projections_lock = threading.Lock()
+
+    @staticmethod
+    def get(res_x, res_y, lense_coeff_x_pos):
+        key = (res_x, res_y, lense_coeff_x_pos)
+        with FloorProjection.projections_lock:
+            projection = FloorProjection.projections.get(key)
+            if projection is None:
+                projection = FloorProjection(res_x, res_y, lense_coeff_x_pos)
+                FloorProjection.projections[key] = projection
+            return projection
+
+    def __init__(self, res_x, res_y, lense_coeff_x_pos):
+        self.res_x = res_x
+        self.res_y = res_y
+        # Distance on y axis, only depends on the row
+        y_percent = np.arange(res_y) * 100 / res_y
+        a = np.polyval(poly_coefficients, np.minimum(max_y_pos, 100 - y_percent))
+        y_pos = H * np.tan(a)
+        # Position on x axis, the scale of a row depends on its distance
+        x_scale = (MAX_DISTANCE / (MAX_DISTANCE - np.minimum(y_pos, MAX_DISTANCE - 0.1))) * ROBOT_WIDTH / 2
+        x_offset = (np.arange(res_x) * 100 / res_x - 50) / 50
+        self.table = np.empty((res_y, res_x, 2), dtype=np.float32)
+        self.table[:, :, 0] = np.outer(x_scale * lense_coeff_x_pos, x_offset)
+        self.table[:, :, 1] = y_pos[:, np.newaxis]
+
+    def project_pixels(self, xs, ys):
+        # Project arrays of pixel coordinates, returns an array of (x, y) floor positions
+        xs = np.clip(np.asarray(xs, dtype=np.intp), 0, self.res_x - 1)
+        ys = np.clip(np.asarray(ys, dtype=np.intp), 0, self.res_y - 1)
+        return self.table[ys, xs]
+
+    def project(self, x_percents, y_percents):
+        # Project arrays of positions expressed in % of the frame
+        xs = np.rint(np.asarray(x_percents) * self.res_x / 100)
+        ys = np.rint(np.asarray(y_percents) * self.res_y / 100)
+        return self.project_pixels(xs, ys)
+
+    def project_mask(self, mask):
+        # Floor positions of all the pixels of a mask, e.g. an obstacle or a detection
+        return self.table[mask.astype(bool)]
+
+
 def get_camera_index():
     # checks the first 10 indexes.
     for index in [1, 0]:
@@ -47,6 +100,11 @@ def get_camera_index():
 
 
 class CaptureDevice(object):
+    DEFAULT_DEVICE_FRAMERATE = 30
+    # Pyramid scale of the gray images provided by the Picamera2 low resolution stream: the half resolution images read
+    # by the face and QR code detections, the quarter resolution ones are downscaled from them
+    LORES_SCALE = 2
+    MAX_QUEUED_FRAMES = 5
     available_device = None
 
     def __init__(self, resolution, capturing_device, angle):
@@ -55,137 +113,195 @@ class CaptureDevice(object):
         self.res_x, self.res_y = resolution.split('x')
         self.res_x, self.res_y = int(self.res_x), int(self.res_y)
         self.angle = angle
-        if self.capturing_device == "usb":  # USB Camera?
+        self.ring = FrameRing(shape=(self.res_y, self.res_x, 3), device=self)
+        self.scheduler = None
+        self.capturing = False
+        self.capturing_thread = None
+        self.active = threading.Event()
+        self.native_mjpeg = False
+        self.lores_size = None
+        # Replayed or generated frames, used to benchmark the pipeline without a camera
+        self.source = None
+        if self.capturing_device == "replay":
+            self.source = ReplaySource(Config.get("capturing_replay_source"))
+        elif self.capturing_device == "synthetic":
+            self.source = SyntheticSource(self.res_x, self.res_y)
+        elif self.capturing_device == "usb":  # USB Camera?
+            mjpeg_fourcc = cv2.VideoWriter_fourcc(*"MJPG")
             self.device = cv2.VideoCapture(Camera.available_device)
+            if Config.get("usb_camera_mjpeg"):
+                self.device.set(cv2.CAP_PROP_FOURCC, mjpeg_fourcc)
             self.device.set(cv2.CAP_PROP_FRAME_WIDTH, self.res_x)
             self.device.set(cv2.CAP_PROP_FRAME_HEIGHT, self.res_y)
+            # Keep as few frames as possible queued in the driver, not supported by all the backends
+            self.device.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+            if Config.get("usb_camera_mjpeg") and int(self.device.get(cv2.CAP_PROP_FOURCC)) == mjpeg_fourcc:
+                # Get the JPEG frames of the camera as they are, they are decoded only if needed
+                self.native_mjpeg = self.device.set(cv2.CAP_PROP_CONVERT_RGB, 0)
+                logger.info(f"USB camera native MJPEG: {self.native_mjpeg}")
         else:
             if platform.machine() == "aarch64":
                 self.device = picamera2.Picamera2()
-                config = self.device.create_preview_configuration({"size": (self.res_x, self.res_y), "format": "RGB888"})
+                # The ISP also outputs the frames at the size of the gray analysis images, for the vision handlers
+                lores_size = (self.res_x // CaptureDevice.LORES_SCALE, self.res_y // CaptureDevice.LORES_SCALE)
+                if Config.get("picamera_lores_stream") and lores_size[0] % 2 == 0 and lores_size[1] % 2 == 0:
+                    config = self.device.create_preview_configuration(
+                        {"size": (self.res_x, self.res_y), "format": "RGB888"},
+                        lores={"size": lores_size, "format": "YUV420"},
+                    )
+                else:
+                    config = self.device.create_preview_configuration({"size": (self.res_x, self.res_y), "format": "RGB888"})
                 self.device.configure(config)
+                lores_config = self.device.camera_configuration().get("lores")
+                if lores_config is not None and tuple(lores_config["size"]) == lores_size:
+                    self.lores_size = lores_size
+                logger.info(f"Picamera2 lores stream: {self.lores_size}")
                 self.device.start()
             else:
                 self.device = picamera.PiCamera(resolution=resolution)
 
     def add_overlay(self, frame, overlay_frame, pos, size):
-        resized = cv2.resize(overlay_frame,
-                             [int((size[0] * self.res_x) / 100), int((size[1] * self.res_y) / 100)],
-                             interpolation=cv2.INTER_AREA)
-        x_offset, y_offset = [int((pos[0] * self.res_x) / 100), int((pos[1] * self.res_y) / 100)]
-
-        frame[y_offset:y_offset + resized.shape[0], x_offset:x_offset + resized.shape[1]] = resized
+        res_y, res_x = frame.shape[:2]
+        x_offset, y_offset = [int((pos[0] * res_x) / 100), int((pos[1] * res_y) / 100)]
+        width = min(int((size[0] * res_x) / 100), res_x - x_offset)
+        height = min(int((size[1] * res_y) / 100), res_y - y_offset)
+        # Resize straight into the destination region of the frame, no intermediate buffer
+        cv2.resize(
+            overlay_frame,
+            (width, height),
+            dst=frame[y_offset:y_offset + height, x_offset:x_offset + width],
+            interpolation=cv2.INTER_AREA,
+        )
 
     def add_radar(self, frame, pos, size):
         motor_status = Motor.serialize()
-        left_us_distance, front_us_distance, right_us_distance = motor_status.get('us_distances')
-        radius = 0.15 * self.res_x
-
-        color = (0, 255, 0)
-        thickness = 2
-
-        def add_circle(distance, angle):
-            normalized_distance = radius * distance / 0.5
-            if normalized_distance <= radius:
-                cx = normalized_distance * math.sin(angle * math.pi / 180)
-                cy = normalized_distance * math.cos(angle * math.pi / 180)
-                x = int(cx + self.res_x // 2)
-                y = int(self.res_y - cy)
-                cv2.circle(frame, (x, y), radius=4, color=(0, 0, 255), thickness=2)
-
-        cv2.circle(frame, (self.res_x // 2, self.res_y), radius=int(radius), color=(0, 255, 0), thickness=2)
-        cv2.line(frame,
-                 (self.res_x // 2, self.res_y),
-                 (int(self.res_x // 2 - radius * math.sin(math.pi / 4)), int(self.res_y - radius * math.sin(math.pi / 4))),
-                 color,
-                 thickness)
-        cv2.circle(frame, (self.res_x // 2, self.res_y), radius=int(2 * radius / 3), color=(0, 255, 0), thickness=2)
-        cv2.line(frame,
-                 (self.res_x // 2, self.res_y),
-                 (self.res_x // 2, int(self.res_y - radius)),
-                 color,
-                 thickness)
-        cv2.circle(frame, (self.res_x // 2, self.res_y), radius=int(radius / 3), color=(0, 255, 0), thickness=2)
-        cv2.line(frame,
-                 (self.res_x // 2, self.res_y),
-                 (int(self.res_x // 2 + radius * math.sin(math.pi / 4)), int(self.res_y - radius * math.sin(math.pi / 4))),
-                 color,
-                 thickness)
-
-        if left_us_distance is not None:
-            add_circle(left_us_distance, -45)
-        if front_us_distance is not None:
-            add_circle(front_us_distance, 0)
-        if right_us_distance is not None:
-            add_circle(right_us_distance, 45)
+        HUDCompositor.for_frame(frame).add_radar(frame, motor_status.get('us_distances'))
 
     def add_navigation_lines(self, frame):
-        color = (0, 255, 0)
-        thickness = 2
-
-        # Visor
-        radius = 30
-        y_offest = 30
-        center_x = self.res_x // 2
-        center_y = self.res_y // 2 + y_offest
-        cv2.line(frame, (center_x, center_y + (radius + 10)), (center_x, center_y - (radius + 10)), color, thickness)
-        cv2.line(frame, (center_x + (radius + 10), center_y), (center_x - (radius + 10), center_y), color, thickness)
-        cv2.circle(frame, (center_x, center_y), radius, color, thickness)
-
-        # Path
-        path_bottom = 100
-        cv2.line(frame, (center_x, center_y), (path_bottom, self.res_y), color, thickness)
-        cv2.line(frame, (center_x, center_y), (self.res_x - path_bottom, self.res_y), color, thickness)
-
-        # Speed and distance
-        font = cv2.FONT_HERSHEY_SIMPLEX
-        fontScale = 0.8
-        color = (0, 255, 0)
-
         motor_status = Motor.serialize()
-
-        # ODO
-        _, text_h = cv2.getTextSize(text="ODO", fontFace=font, fontScale=fontScale, thickness=thickness)[0]
-        cv2.putText(frame, f"ODO: {motor_status['abs_distance'] / 1000:.2f} m", (5, 5 + text_h), font, fontScale, color, thickness)
-
-        # Mode
-        if BaseHandler.state is not None:
-            state = BaseHandler.state.upper().replace("_", " ")
-            text_w, text_h = cv2.getTextSize(text=state, fontFace=font, fontScale=fontScale, thickness=thickness)[0]
-            cv2.putText(frame, state, (self.res_x - text_w - 5, 5 + text_h), font, fontScale, color, thickness)
-
-        # Left
-        cv2.putText(frame, f"{motor_status['left']['speed_rpm']} RPM", (5, self.res_y - 15), font, fontScale, color, thickness)
-        cv2.rectangle(frame, (5, self.res_y - 50), (5 + 40, self.res_y - 50 - 400), color, thickness)
-        cv2.rectangle(frame, (5, self.res_y - 50 - 200), (5 + 40, self.res_y - 50 - 200 - int(motor_status['left']['duty'] * 2)), color, -1)
-
-        # Right
-        right_speed_str = f"{motor_status['right']['speed_rpm']} RPM"
-        text_w, text_h = cv2.getTextSize(text=right_speed_str, fontFace=font, fontScale=fontScale, thickness=thickness)[0]
-        cv2.putText(frame, right_speed_str, (self.res_x - text_w - 5, self.res_y - 15), font, fontScale, color, thickness)
-        cv2.rectangle(frame, (self.res_x - 5, self.res_y - 50), (self.res_x - 5 - 40, self.res_y - 50 - 400), color, thickness)
-        cv2.rectangle(frame, (self.res_x - 5, self.res_y - 50 - 200), (self.res_x - 5 - 40, self.res_y - 50 - 200 - int(motor_status['right']['duty'] * 2)), color, -1)
+        HUDCompositor.for_frame(frame).add_navigation_lines(frame, motor_status, BaseHandler.state)
 
     def grab(self):
         if self.capturing_device == "usb":
-            self.device.grab()
+            # Drain the frames queued by the driver while we were sleeping, until a grab blocks on the device, which
+            # means the grabbed frame is a fresh one
+            fresh_frame_delay = 0.5 / (self.device.get(cv2.CAP_PROP_FPS) or CaptureDevice.DEFAULT_DEVICE_FRAMERATE)
+            for _ in range(CaptureDevice.MAX_QUEUED_FRAMES):
+                start = time.monotonic()
+                self.device.grab()
+                if time.monotonic() - start > fresh_frame_delay:
+                    break
 
     def retrieve(self):
         self.frame_counter += 1
-        if self.capturing_device == "usb":
-            ret, frame = self.device.retrieve()
-            return frame
+        frame = self.ring.acquire()
+        timestamp = time.time()
+        lores_image = None
+        if self.source is not None:
+            image = self.source.read(frame.buffer)
+            if image is None:
+                return None
+            if image.ndim == 1:
+                return self.publish_jpeg(frame, image, timestamp)
+        elif self.native_mjpeg:
+            ret, data = self.device.retrieve()
+            if not ret:
+                return None
+            if data.ndim == 1 or data.shape[0] == 1:
+                return self.publish_jpeg(frame, data.reshape(-1), timestamp)
+            # Not a JPEG, the backend ignored the conversion setting
+            image = data
+        elif self.capturing_device == "usb":
+            ret, image = self.device.retrieve(frame.buffer)
+            if not ret:
+                return None
         else:  # picamera
             if platform.machine() == "aarch64":
-                frame = self.device.capture_array()
-                return frame
+                if self.lores_size is not None:
+                    # Both streams of the same request
+                    request = self.device.capture_request()
+                    try:
+                        image = request.make_array("main")
+                        # The Y plane of the YUV420 image is the gray image
+                        width, height = self.lores_size
+                        lores_image = request.make_array("lores")[:height, :width]
+                    finally:
+                        request.release()
+                else:
+                    image = self.device.capture_array()
             else:
                 output = PiRGBArray(self.device)
                 self.device.capture(output, format="bgr", use_video_port=True)
-                return frame
+                image = output.array
+        if image.shape != frame.shape:
+            # Actual resolution differs from the configured one, reallocate the ring
+            logger.info(f"Resizing frame ring to {image.shape}")
+            self.ring.resize(image.shape)
+            frame = self.ring.acquire()
+        if image is not frame.buffer:
+            np.copyto(frame.buffer, image)
+        frame.set_jpeg(None)
+        if lores_image is not None and image.shape[:2] == (self.res_y, self.res_x):
+            frame.set_analysis_image(CaptureDevice.LORES_SCALE, True, lores_image)
+        self.ring.publish(frame, timestamp)
+        return frame
+
+    def publish_jpeg(self, frame, data, timestamp):
+        shape = get_jpeg_shape(data)
+        if shape is None:
+            logger.warning("Invalid JPEG frame")
+            return None
+        if shape != frame.shape:
+            logger.info(f"Resizing frame ring to {shape}")
+            self.ring.resize(shape)
+            frame = self.ring.acquire()
+        frame.set_jpeg(data)
+        self.ring.publish(frame, timestamp)
+        return frame
+
+    def start(self, frame_rate):
+        # Each device captures on its own thread and publishes the frames in its ring
+        self.scheduler = CaptureScheduler(frame_rate)
+        self.capturing = True
+        self.active.set()
+        self.capturing_thread = threading.Thread(target=self.capture_continuous, daemon=True)
+        self.capturing_thread.start()
+
+    def set_active(self, active):
+        # Inactive devices stop capturing until they are needed again
+        if active:
+            self.active.set()
+        else:
+            self.active.clear()
+
+    def capture_continuous(self):
+        while self.capturing:
+            try:
+                if not self.active.wait(timeout=1.0):
+                    continue
+                self.scheduler.frame_rate = Camera.frame_rate
+                self.scheduler.wait_next_frame()
+                with pipeline_stats.measure("grab"):
+                    self.grab()
+                with pipeline_stats.measure("retrieve"):
+                    frame = self.retrieve()
+                if frame is not None:
+                    self.scheduler.frame_captured()
+            except Exception:
+                logger.error("Unexpected exception in device capture", exc_info=True)
+                time.sleep(self.scheduler.frame_delay)
+
+    def stop(self):
+        self.capturing = False
+        self.active.set()
+        if self.capturing_thread is not None and self.capturing_thread is not threading.current_thread():
+            self.capturing_thread.join()
+        self.capturing_thread = None
 
     def close(self):
-        if self.capturing_device == "usb":
+        if self.source is not None:
+            self.source.release()
+        elif self.capturing_device == "usb":
             self.device.release()
         else:
             self.device.close()
@@ -205,22 +321,26 @@ class Camera(object):
     servo_id = 1
     servo_center_position = 60
     servo_position = 0
-    new_streaming_frame_callbacks = {}
-    streaming_frame_callbacks = threading.Lock()
+    scheduler = None
+    front_res_x = 1280
+    front_res_y = 720
+    lense_coeff_x_pos = 0.8
+    hud = HUD_MODE_SERVER
+    scene_detector = SceneChangeDetector(threshold=0, keyframe_interval=1.0)
+    encoder = FrameEncoder(tiers=EncodingTier.parse(f"{DEFAULT_TIER}:100:95"))
 
+    @staticmethod
+    def add_new_streaming_frame_callback(name, callback, tier=DEFAULT_TIER):
+        Camera.encoder.add_subscriber(name, callback, tier)
 
     @staticmethod
-    def add_new_streaming_frame_callback(name, callback):
-        Camera.streaming_frame_callbacks.acquire()
-        Camera.new_streaming_frame_callbacks[name] = callback
-        Camera.streaming_frame_callbacks.release()
+    def add_streaming_frame_follower(name, callback):
+        # Gets the frames of the largest tier streamed to the others, without causing any encoding
+        Camera.encoder.add_follower(name, callback)
 
     @staticmethod
     def remove_new_streaming_frame_callback(name):
-        Camera.streaming_frame_callbacks.acquire()
-        if name in Camera.new_streaming_frame_callbacks:
-            del Camera.new_streaming_frame_callbacks[name]
-        Camera.streaming_frame_callbacks.release()
+        Camera.encoder.remove_subscriber(name)
 
     @staticmethod
     def setup():
@@ -229,6 +349,17 @@ class Camera(object):
         Camera.servo_id = Config.get("camera_servo_id")
         Camera.center_position()
         Camera.frame_rate = Config.get("capturing_framerate")
+        Camera.front_res_x, Camera.front_res_y = [
+            int(v) for v in Config.get("front_capturing_resolution").split('x')
+        ]
+        Camera.lense_coeff_x_pos = Config.get("lense_coeff_x_pos")
+        Camera.hud = Config.get("video_hud")
+        Camera.scene_detector = SceneChangeDetector(
+            threshold=Config.get("video_scene_change_threshold"),
+            keyframe_interval=Config.get("video_keyframe_interval"),
+        )
+        Camera.encoder.set_tiers(EncodingTier.parse(Config.get("video_stream_tiers")))
+        Camera.encoder.nb_of_workers = max(1, Config.get("video_encoder_workers"))
         if Config.get('front_capturing_device') == "usb":
             Camera.available_device = get_camera_index()
             Camera.status = "KO" if Camera.available_device is None else "OK"
@@ -274,60 +405,137 @@ class Camera(object):
                 angle=back_angle
             )
 
+        Camera.front_capture_device.start(Camera.frame_rate)
+        if Camera.back_capture_device is not None and Camera.back_capture_device is not Camera.front_capture_device:
+            Camera.back_capture_device.start(Camera.frame_rate)
+
         Camera.capturing = True
-        frame_delay = 1.0 / Camera.frame_rate
-        last_frame_ts = 0
+        last_sequence = 0
         while Camera.capturing:
+            frame = None
+            overlay_frame = None
             try:
-                Camera.front_capture_device.grab()
-                if Camera.back_capture_device is not None:
-                    Camera.back_capture_device.grab()
-                now = time.time()
-                if now > last_frame_ts + frame_delay:
-                    frame_delay = 1.0 / Camera.frame_rate
-                    last_frame_ts = now
-                    if Camera.back_capture_device is None or Camera.selected_camera == "front":
-                        frame = Camera.front_capture_device.retrieve()
-                        BaseHandler.emit_event(
-                            topic="camera", event_type="new_front_camera_frame", data=dict(frame=frame),
+                front_selected = Camera.back_capture_device is None or Camera.selected_camera == "front"
+                if front_selected:
+                    capture_device = Camera.front_capture_device
+                    other_capture_device = Camera.back_capture_device
+                else:
+                    capture_device = Camera.back_capture_device
+                    other_capture_device = Camera.front_capture_device
+                capture_device.set_active(True)
+                if other_capture_device is not None and other_capture_device is not capture_device:
+                    other_capture_device.set_active(Camera.overlay)
+                Camera.scheduler = capture_device.scheduler
+
+                # Wait for the next frame of the streamed device
+                frame = capture_device.ring.wait_for_frame(last_sequence, timeout=1.0, pin=True)
+                if frame is None:
+                    continue
+                last_sequence = frame.sequence
+                server_hud = Camera.hud == HUD_MODE_SERVER
+                front_consumers = front_selected and BaseHandler.has_event_consumers("camera", "new_front_camera_frame")
+                streaming_consumers = BaseHandler.has_event_consumers("camera", "new_streaming_frame")
+                overlay = other_capture_device is not None and Camera.overlay
+                # Frames nobody draws on or looks at are streamed as captured, without being decoded when they are JPEG
+                if server_hud or front_consumers or streaming_consumers or overlay:
+                    with pipeline_stats.measure("annotate"):
+                        annotated = frame.prepare_annotation()
+                    if front_consumers:
+                        with pipeline_stats.measure("front_handlers"):
+                            BaseHandler.emit_event(
+                                topic="camera",
+                                event_type="new_front_camera_frame",
+                                data=dict(frame=frame.raw, envelope=frame),
+                            )
+                        frame.stamps["handlers"] = time.time()
+                    with pipeline_stats.measure("hud"):
+                        if server_hud:
+                            if front_selected:
+                                # Navigation
+                                capture_device.add_navigation_lines(annotated)
+                            capture_device.add_radar(annotated, [50, 0], [25, 25])
+                        if overlay:
+                            # Picture in picture with the freshest frame of the other device
+                            overlay_frame = other_capture_device.ring.latest(pin=True)
+                            if overlay_frame is not None:
+                                capture_device.add_overlay(annotated, overlay_frame.raw, [75, 0], [25, 25])
+                    frame.stamps["hud"] = time.time()
+
+                    if streaming_consumers:
+                        with pipeline_stats.measure("streaming_handlers"):
+                            BaseHandler.emit_event(
+                                topic="camera",
+                                event_type="new_streaming_frame",
+                                data=dict(frame=annotated, envelope=frame),
+                            )
+
+                # Only encoded when there are subscribers, the stream viewers or the recording
+                if Camera.encoder.has_subscribers():
+                    telemetry = None
+                    if Camera.hud == HUD_MODE_CLIENT or Camera.scene_detector.enabled:
+                        telemetry = Camera.get_telemetry(frame, front_selected)
+                    if Camera.hud == HUD_MODE_CLIENT:
+                        frame.telemetry = telemetry
+                    # Static scene, nothing new to send
+                    with pipeline_stats.measure("scene"):
+                        changed = not Camera.scene_detector.enabled or Camera.scene_detector.has_changed(
+                            [frame] if overlay_frame is None else [frame, overlay_frame],
+                            Camera.get_telemetry_signature(telemetry),
                         )
-                        # Navigation
-                        Camera.front_capture_device.add_navigation_lines(frame)
-                    else:
-                        frame = Camera.back_capture_device.retrieve()
-                    Camera.front_capture_device.add_radar(frame, [50, 0], [25, 25])
-                    if Camera.back_capture_device is not None and Camera.overlay:
-                        if Camera.selected_camera == "front":
-                            overlay_frame = Camera.back_capture_device.retrieve()
-                            Camera.front_capture_device.add_overlay(frame, overlay_frame, [75, 0], [25, 25])
-                        else:
-                            overlay_frame = Camera.front_capture_device.retrieve()
-                            Camera.back_capture_device.add_overlay(frame, overlay_frame, [75, 0], [25, 25])
-
-                    if frame is not None:
-                        BaseHandler.emit_event(
-                            topic="camera", event_type="new_streaming_frame", data=dict(frame=frame),
-                        )
-
-                        if Camera.streaming:
-                            frame = cv2.imencode('.jpg', frame)[1].tostring()
-                            Camera.streaming_frame_callbacks.acquire()
-                            for callback in Camera.new_streaming_frame_callbacks.values():
-                                callback(frame)
-                            Camera.streaming_frame_callbacks.release()
+                    if changed:
+                        Camera.encoder.submit(frame)
             except Exception:
                 logger.error("Unexpected exception in continuous capture", exc_info=True)
-                if Camera.streaming_frame_callbacks.locked():
-                    Camera.streaming_frame_callbacks.release()
                 continue
+            finally:
+                if frame is not None:
+                    frame.release()
+                if overlay_frame is not None:
+                    overlay_frame.release()
+        Camera.front_capture_device.stop()
         Camera.front_capture_device.close()
-        Camera.front_capture_device = None
-        if Camera.back_capture_device is not None:
+        if Camera.back_capture_device is not None and Camera.back_capture_device is not Camera.front_capture_device:
+            Camera.back_capture_device.stop()
             Camera.back_capture_device.close()
-            Camera.back_capture_device = None
+        Camera.front_capture_device = None
+        Camera.back_capture_device = None
         Camera.capturing = False
         logger.info("Stop Capture")
 
+    @staticmethod
+    def get_telemetry(frame, front_selected):
+        # Everything the client needs to draw the HUD of a frame, positions are in pixels of the captured frame
+        return dict(
+            sequence=frame.sequence,
+            timestamp=frame.timestamp,
+            width=frame.shape[1],
+            height=frame.shape[0],
+            navigation=front_selected,
+            state=BaseHandler.state,
+            motor=Motor.serialize(),
+            handlers=BaseHandler.get_telemetry(),
+        )
+
+    @staticmethod
+    def get_telemetry_signature(telemetry):
+        # What changes the HUD, used to tell if a frame of a static scene must be sent. Motor values are rounded to
+        # what the HUD shows, so that the noise of the sensors doesn't make a static scene change.
+        if telemetry is None:
+            return None
+        signature = {key: value for key, value in telemetry.items() if key not in ("sequence", "timestamp", "motor")}
+        motor_status = telemetry["motor"]
+        signature["motor"] = (
+            motor_status["left"],
+            motor_status["right"],
+            round(motor_status["abs_distance"] / 10),
+            # Obstacles are only shown on the radar when closer than 50cm
+            tuple(
+                round(distance / 0.05) if distance is not None and distance <= 0.5 else None
+                for distance in motor_status["us_distances"]
+            ),
+        )
+        return signature
+
     @staticmethod
     def start_continuous_capture():
         if not Camera.capturing or Camera.capturing_thread is None or not Camera.capturing_thread.is_alive():
@@ -355,16 +563,19 @@ class Camera(object):
         Camera.selected_camera = selected_camera
         Camera.overlay = overlay
 
+    @staticmethod
+    def get_floor_projection():
+        return FloorProjection.get(Camera.front_res_x, Camera.front_res_y, Camera.lense_coeff_x_pos)
+
     @staticmethod
     def get_target_position(x, y):
-        # Distance on y axis
-        a = 0
-        for n, p in enumerate(reversed(poly_coefficients)):
-            a += p * math.pow(min(max_y_pos, (100 - y)), n)
-        y_pos = H * math.tan(a)
-
-        x_pos = (MAX_DISTANCE / (MAX_DISTANCE - min(y_pos, MAX_DISTANCE - 0.1))) * ((x - 50) / 50) * ROBOT_WIDTH/2
-        return x_pos * Config.get("lense_coeff_x_pos"), y_pos
+        x_pos, y_pos = Camera.get_floor_projection().project(x, y)
+        return float(x_pos), float(y_pos)
+
+    @staticmethod
+    def get_target_positions(xs, ys):
+        # Batch version of get_target_position
+        return Camera.get_floor_projection().project(xs, ys)
 
     @staticmethod
     def serialize():
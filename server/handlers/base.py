@@ -14,8 +14,13 @@ class BaseHandler(object):
     @staticmethod
     def get_handler_for_event(topic, event_type):
         handlers = BaseHandler.event_listener.get(f"{topic}-*", [])
-        handlers += BaseHandler.event_listener.get(f"{topic}-{event_type}", [])
-        return [h for h in handlers if h.eligible]
+        handlers = handlers + BaseHandler.event_listener.get(f"{topic}-{event_type}", [])
+        return [h for h in handlers if h.eligible and h.wants_event(topic, event_type)]
+
+    @staticmethod
+    def has_event_consumers(topic, event_type):
+        # Producers can skip preparing an event nobody wants
+        return len(BaseHandler.get_handler_for_event(topic, event_type)) > 0
 
     @staticmethod
     def get_handler(name):
@@ -26,6 +31,17 @@ class BaseHandler(object):
         for handler in BaseHandler.get_handler_for_event(topic, event_type):
             handler.receive_event(topic, event_type, data)
 
+    @staticmethod
+    def get_telemetry():
+        # Telemetry of all the handlers, sent with the frames for the client to draw the HUD
+        telemetry = {}
+        for name, handler in BaseHandler.handlers.items():
+            if handler.eligible:
+                handler_telemetry = handler.get_handler_telemetry()
+                if handler_telemetry is not None:
+                    telemetry[name] = handler_telemetry
+        return telemetry
+
     @staticmethod
     def set_state(state):
         BaseHandler.state = state
@@ -48,6 +64,14 @@ class BaseHandler(object):
                 self.eligible = False
                 break
 
+    def wants_event(self, topic, event_type):
+        # Handlers registered for an event but only interested in it in some states override this
+        return True
+
+    def get_handler_telemetry(self):
+        # Handlers having something to show in the HUD override this
+        return None
+
     def register_for_event(self, topic, event_type):
         key = topic
         if event_type is None:
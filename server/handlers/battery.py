@@ -1,8 +1,8 @@
-import cv2
-
+from camera import Camera
 from handlers.base import BaseHandler, register_handler
 from models import Config
 from uart import UART, MessageOriginator, MessageType
+from video.hud import HUD_MODE_SERVER, HUDCompositor
 
 
 @register_handler("battery", needs=["battery_tester"])
@@ -27,21 +27,16 @@ class BatteryHandler(BaseHandler):
         UART.write("B:S")
 
     def add_battery_level(self, frame):
-        # Add REC indicator
         text = f"BAT: {self.battery_level}%"
-        thickness = 2
         if self.battery_level < 10:
             color = (0, 0, 255)
         else:
             color = (0, 255, 0)
-        font = cv2.FONT_HERSHEY_SIMPLEX
-        fontScale = 0.8
-        text_w, text_h = cv2.getTextSize(
-            text=text, fontFace=font, fontScale=fontScale, thickness=thickness
-        )[0]
-        cv2.putText(
-            frame, text, (5, 2 * (10 + text_h)), font, fontScale, color, thickness
-        )
+        hud = HUDCompositor.for_frame(frame)
+        hud.draw_text(frame, "battery", text, (5, 2 * (10 + hud.text_height)), color=color)
+
+    def get_handler_telemetry(self):
+        return dict(level=self.battery_level)
 
     def receive_uart_message(self, message, originator, message_type):
         battery_volt = float(message[0])
@@ -50,6 +45,10 @@ class BatteryHandler(BaseHandler):
         )
         self.battery_level = min(100, max(0, self.battery_level))
 
+    def wants_event(self, topic, event_type):
+        # The battery level is only drawn in the server HUD
+        return Camera.hud == HUD_MODE_SERVER
+
     def receive_event(self, topic, event_type, data):
         if self.battery_level is None:
             self.battery_level = 0
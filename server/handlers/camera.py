@@ -1,6 +1,5 @@
 import cv2
 import datetime
-import time
 import os
 
 from PIL import Image
@@ -8,6 +7,10 @@ from PIL import Image
 from camera import Camera
 from handlers.base import BaseHandler, register_handler
 from models import Config
+from video.encoder import DEFAULT_TIER
+from video.hud import HUD_MODE_SERVER, HUDCompositor
+from video.media_writer import MediaWriter, RECORDING_MODE_ENCODE, RECORDING_MODE_PASSTHROUGH
+from video.prerecord import PrerecordBuffer
 
 
 @register_handler("camera")
@@ -15,50 +18,55 @@ class CameraHandler(BaseHandler):
 
     def __init__(self):
         super().__init__()
-        self.frame_rate = Camera.frame_rate
-        self.video_start_ts = None
-        self.frame_counter = 0
         self.video_source = "streaming"
         self.picture_source = "streaming"
         self.picture_destination = "file"
         self.picture_format = "png"
         self.capture_video = False
+        self.recording_mode = RECORDING_MODE_ENCODE
         self.capture_picture = False
         self.register_for_message("camera")
         self.register_for_event("camera", "new_streaming_frame")
         self.register_for_event("camera", "new_front_camera_frame")
-        self.video_writer = None
         self.video_dir = os.path.join(os.environ["HOME"], "Videos/PiRobot")
         self.video_filename = None
+        self.prerecord = PrerecordBuffer(seconds=0, max_bytes=0)
         if not os.path.isdir(self.video_dir):
             os.mkdir(self.video_dir)
         self.picture_dir = os.path.join(os.environ["HOME"], "Pictures/PiRobot")
         if not os.path.isdir(self.picture_dir):
             os.mkdir(self.picture_dir)
 
+    def setup(self, server):
+        super().setup(server)
+        # Keep the last seconds of the stream, for the recordings to start before the start_video message. The buffer
+        # only reuses the frames encoded for the viewers, it costs no encoding when nobody is watching
+        self.prerecord = PrerecordBuffer(
+            seconds=Config.get("video_prerecord_seconds"), max_bytes=Config.get("video_prerecord_max_bytes")
+        )
+        if self.prerecord.enabled:
+            Camera.add_streaming_frame_follower("prerecord", self.prerecord.add)
+        else:
+            Camera.remove_new_streaming_frame_callback("prerecord")
+
     async def process(self, message, protocol):
         if message["action"] == "set_position":
             Camera.set_position(message["args"]["position"])
-            await self.server.send_status(protocol)
+            await self.server.send_camera_status(protocol)
         elif message["action"] == "center_position":
             Camera.center_position()
-            await self.server.send_status(protocol)
+            await self.server.send_camera_status(protocol)
         elif message["action"] == "start_video":
-            if self.video_writer is not None:
-                self.video_writer.release()
-                self.video_writer = None
             self.video_source = message["args"].get("source", "streaming")
-            self.capture_video = True
+            self.start_video()
             await protocol.send_message("video", dict(status="recording"))
         elif message["action"] == "stop_video":
             self.capture_video = False
-            self.video_start_ts = None
-            self.frame_counter = 0
-            if self.video_writer is not None:
-                self.video_writer.release()
-                self.video_writer = None
-                self.video_filename = None
+            Camera.remove_new_streaming_frame_callback("recording")
+            if self.video_filename is not None:
+                MediaWriter.stop_video()
                 await protocol.send_message("video", dict(status="new_file", filename=self.video_filename))
+                self.video_filename = None
         elif message["action"] == "capture_picture":
             self.capture_picture = True
             self.picture_source = message["args"].get("source", "streaming")
@@ -70,16 +78,45 @@ class CameraHandler(BaseHandler):
         creation_time = datetime.datetime.now().strftime("%y%m%d_%H%M%S")
         return f"{robot_name}_{self.video_source}_{creation_time}"
 
-    def start_video(self, frame):
+    def start_video(self):
+        # The media writer opens the file with the size of the first frame
         self.video_filename = f"{self.get_filename()}.avi"
-        self.frame_rate = Camera.frame_rate
-        self.video_writer = cv2.VideoWriter(
-            filename=os.path.join(self.video_dir, self.video_filename),
-            fourcc=cv2.VideoWriter_fourcc(*Config.get("video_codec")),
-            fps=self.frame_rate,
-            frameSize=(frame.shape[1], frame.shape[0]),
-            isColor=True,
+        # Only the streamed frames are encoded, the front camera frames are always re-encoded
+        if self.video_source == "streaming":
+            self.recording_mode = Config.get("video_recording_mode")
+        else:
+            self.recording_mode = RECORDING_MODE_ENCODE
+        MediaWriter.start_video(
+            os.path.join(self.video_dir, self.video_filename),
+            Camera.frame_rate,
+            Config.get("video_codec"),
+            self.recording_mode,
         )
+        if self.video_source == "streaming":
+            # Start with the pre-recorded frames, before the live ones
+            for encoded_frame in self.prerecord.flush():
+                MediaWriter.write_encoded_video_frame(encoded_frame, prerecorded=True)
+        if self.recording_mode == RECORDING_MODE_PASSTHROUGH:
+            # Record the JPEG frames encoded for the stream
+            Camera.add_new_streaming_frame_callback("recording", MediaWriter.write_encoded_video_frame, DEFAULT_TIER)
+        self.capture_video = True
+
+    def wants_event(self, topic, event_type):
+        if event_type == "new_front_camera_frame":
+            source = "front"
+        else:
+            source = "streaming"
+        if self.capture_picture and self.picture_source == source:
+            return True
+        if self.capture_video:
+            if source == "streaming" and self.shows_rec_indicator():
+                return True
+            # Raw frames are needed to encode the video
+            return self.video_source == source and self.recording_mode == RECORDING_MODE_ENCODE
+        return False
+
+    def get_handler_telemetry(self):
+        return dict(recording=self.capture_video)
 
     def receive_event(self, topic, event_type, data):
         if topic == "camera":
@@ -91,8 +128,12 @@ class CameraHandler(BaseHandler):
 
             if video_source is not None:
                 # Capturing Video?
-                if self.capture_video and self.video_source == video_source:
-                    self.record_video_frame(data["frame"])
+                if (
+                    self.capture_video
+                    and self.video_source == video_source
+                    and self.recording_mode == RECORDING_MODE_ENCODE
+                ):
+                    MediaWriter.write_video_frame(data["frame"], data["envelope"].timestamp)
 
                 # Capturing Picture?
                 if self.capture_picture and self.picture_source == video_source:
@@ -103,42 +144,23 @@ class CameraHandler(BaseHandler):
                             image = image.resize((self.server.lcd.height, self.server.lcd.width))
                             self.server.lcd.ShowImage(image)
                     else:
-                        filename=self.get_filename()
-                        cv2.imwrite(
+                        filename = self.get_filename()
+                        MediaWriter.write_picture(
                             os.path.join(self.picture_dir, f"{filename}.{self.picture_format}"), data["frame"]
                         )
                     self.capture_picture = False
 
                 # Add REC indicator
-                if video_source == "streaming" and self.capture_video:
+                if video_source == "streaming" and self.shows_rec_indicator():
                     self.add_rec_indicator(data["frame"])
 
+    def shows_rec_indicator(self):
+        # The REC indicator is drawn on the stream in the server HUD, whatever the recorded source. Not in passthrough:
+        # the streamed frames are the recorded ones, the indicator would be in the video. Encoded videos get the frames
+        # before the indicator is drawn.
+        return self.capture_video and Camera.hud == HUD_MODE_SERVER and self.recording_mode != RECORDING_MODE_PASSTHROUGH
+
     def add_rec_indicator(self, frame):
         # Add REC indicator
-        res_x = len(frame[0])
-        text = "REC"
-        thickness = 2
-        color = (0, 255, 0)
-        font = cv2.FONT_HERSHEY_SIMPLEX
-        fontScale = 0.8
-        text_w, text_h = cv2.getTextSize(
-            text=text, fontFace=font, fontScale=fontScale, thickness=thickness
-        )[0]
-        cv2.putText(
-            frame, text, (int(res_x / 2 - text_w / 2), 5 + text_h), font, fontScale, color, thickness
-        )
-
-    def record_video_frame(self, frame):
-        if self.video_writer is None:
-            self.start_video(frame)
-        self.video_writer.write(frame)
-        self.frame_counter += 1
-        if self.video_start_ts is None:
-            self.video_start_ts = time.time()
-        else:
-            expect_nb_of_frames = int((time.time() - self.video_start_ts) * self.frame_rate)
-            nb_of_missing_frames = expect_nb_of_frames - self.frame_counter
-            if nb_of_missing_frames > 1:
-                for i in range(nb_of_missing_frames):
-                    self.video_writer.write(frame)
-                    self.frame_counter += 1
+        hud = HUDCompositor.for_frame(frame)
+        hud.draw_text(frame, "rec", "REC", (hud.res_x // 2, 5 + hud.text_height), align="center")
@@ -1,12 +1,19 @@
 import cv2
+import functools
+import threading
 
 from camera import Camera
 from handlers.base import BaseHandler, register_handler
 from models import Config
 from motor.motor import Motor
+from video.hud import HUD_MODE_SERVER
+from video.tracker import TemplateTracker
+from video.vision import VisionExecutor
 
-face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-eye_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_eye.xml')
+# Faces and eyes are detected in the half resolution image, eyes only in the faces large enough
+DETECTION_SCALE = 2
+# Between two detections, faces are tracked in the quarter resolution image
+TRACKING_SCALE = 4
 
 
 @register_handler("face_detection")
@@ -18,6 +25,10 @@ class FaceDetectionHandler(BaseHandler):
         self.register_for_message("face_detection")
         self.register_for_event("camera", "new_front_camera_frame")
         self.face_position = None
+        self.detection_pending = False
+        self.next_detection_frame = 0
+        self.tracker = TemplateTracker()
+        self.tracker_lock = threading.Lock()
         self.running = False
         self.frame_counter = 0
 
@@ -40,7 +51,9 @@ class FaceDetectionHandler(BaseHandler):
         if BaseHandler.state == "face_detection":
             BaseHandler.reset_state()
         self.running = False
-        self.face_position = None
+        with self.tracker_lock:
+            self.tracker.reset()
+            self.face_position = None
         Camera.center_position()
 
     def toggle(self):
@@ -49,42 +62,89 @@ class FaceDetectionHandler(BaseHandler):
         else:
             self.start()
 
+    def wants_event(self, topic, event_type):
+        return self.running
+
+    def get_handler_telemetry(self):
+        face_position = self.face_position
+        if self.running and face_position is not None:
+            return dict(face=[int(v) for v in face_position])
+        return None
+
     def receive_event(self, topic, event_type, data):
         if self.running and topic == "camera" and event_type == "new_front_camera_frame" and len(data["frame"]) > 0:
-            self.detect_face(frame=data["frame"])
+            self.detect_face(frame=data["envelope"])
             self.frame_counter += 1
 
     def detect_face(self, frame):
-        res_y = len(frame)
-        res_x = len(frame[0])
-        # Run face detection every second
-        if self.frame_counter % Camera.frame_rate == 0:
-            self.face_position = None
-            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            faces = face_cascade.detectMultiScale(gray, 1.1, 4)
-            # Look for faces with 2 eyes or more
-            for (x, y, w, h) in faces:
-                size_percent = 100 * w / res_x
-                if size_percent < 5 or size_percent > 40:
-                    continue
-                if self.face_position is None:
-                    self.face_position = (x, y, w, h)
-                roi_gray = gray[y:y + h, x:x + w]
-                eyes = eye_cascade.detectMultiScale(roi_gray)
-                if len(eyes) >= 2:  # At least 2 eyes :-) Third one could be the mouth
-                    self.face_position = (x, y, w, h)
-                    break
-
-            if self.face_position is not None:
-                x, y, w, h = self.face_position
-                timeout = 3
-                x_pos = (x + w//2) * 100 / res_x
-                y_pos = (y + h // 2) * 100 / res_y
-                Camera.set_position(y)
-                x_pos, y_pos = Camera.get_target_position(x_pos, y_pos)
-                Motor.move_to_target(x_pos, y_pos, self.follow_face_speed, timeout)
-
-        if self.running and self.face_position is not None:
-            x, y, w, h = self.face_position
-            cv2.rectangle(frame, (x, y), (x + w, y + h), (255, 255, 255), 2)
+        res_y, res_x = frame.shape[:2]
+        tracking_image = frame.get_image(scale=TRACKING_SCALE, gray=True)
+
+        # Follow the face on every frame between detections
+        with self.tracker_lock:
+            if self.tracker.tracking:
+                box = self.tracker.update(tracking_image)
+                if box is not None:
+                    self.face_position = tuple(v * TRACKING_SCALE for v in box)
+                    self.follow_face(res_x, res_y)
+                else:
+                    # Low confidence, run a new detection right away
+                    self.face_position = None
+                    self.next_detection_frame = self.frame_counter
+            tracking = self.tracker.tracking
+
+        # Run face detection when no face is tracked, in the vision workers
+        if not tracking and not self.detection_pending and self.frame_counter >= self.next_detection_frame:
+            # Only faces between 5% and 40% of the frame width
+            self.detection_pending = True
+            if not VisionExecutor.submit(
+                "detect_faces",
+                frame.get_image(scale=DETECTION_SCALE, gray=True),
+                functools.partial(self.faces_detected, res_x, res_y, tracking_image.copy()),
+                scale=DETECTION_SCALE,
+                min_size=int(0.05 * res_x),
+                max_size=int(0.4 * res_x),
+            ):
+                self.detection_pending = False
+
+        # With the client HUD, the face is drawn by the client from the telemetry
+        face_position = self.face_position
+        if self.running and face_position is not None and Camera.hud == HUD_MODE_SERVER:
+            x, y, w, h = face_position
+            cv2.rectangle(frame.annotated, (x, y), (x + w, y + h), (255, 255, 255), 2)
+
+    def faces_detected(self, res_x, res_y, tracking_image, faces):
+        # Called by the vision executor once the detection is completed
+        self.detection_pending = False
+        if not self.running or faces is None:
+            return
+        face_position = None
+        # Look for faces with 2 eyes or more, the eyes of the small faces are not checked
+        for x, y, w, h, nb_of_eyes in faces:
+            size_percent = 100 * w / res_x
+            if size_percent < 5 or size_percent > 40:
+                continue
+            if face_position is None:
+                face_position = (x, y, w, h)
+            if nb_of_eyes is not None and nb_of_eyes >= 2:  # At least 2 eyes :-) Third one could be the mouth
+                face_position = (x, y, w, h)
+                break
+
+        with self.tracker_lock:
+            self.face_position = face_position
+            if face_position is None:
+                # No face, try again in a second
+                self.next_detection_frame = self.frame_counter + Camera.frame_rate
+            else:
+                # Track the face from the frame it was detected in
+                self.tracker.init(tracking_image, tuple(v // TRACKING_SCALE for v in face_position))
+                self.follow_face(res_x, res_y)
 
+    def follow_face(self, res_x, res_y):
+        x, y, w, h = self.face_position
+        timeout = 3
+        x_pos = (x + w//2) * 100 / res_x
+        y_pos = (y + h // 2) * 100 / res_y
+        Camera.set_position(y)
+        x_pos, y_pos = Camera.get_target_position(x_pos, y_pos)
+        Motor.move_to_target(x_pos, y_pos, self.follow_face_speed, timeout)
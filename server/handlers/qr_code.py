@@ -1,7 +1,12 @@
-import cv2
+import functools
+import logging
+import time
 
-from camera import Camera
 from handlers.base import BaseHandler, register_handler
+from models import Config
+from video.vision import VisionExecutor
+
+logger = logging.getLogger(__name__)
 
 
 @register_handler("qr_code")
@@ -13,7 +18,26 @@ class QRCodeHandler(BaseHandler):
         self.running = False
         self.register_for_message("qr_code")
         self.register_for_event("camera", "new_front_camera_frame")
-        self.detector = cv2.QRCodeDetector()
+        self.detection_pending = False
+        self.scan_scale = 2
+        self.scan_region = (0, 0, 100, 100)
+        self.scan_rate = 5
+        self.code_ttl = 10.0
+        self.last_scan_ts = 0
+        # Recently decoded payloads: data -> last time it was seen
+        self.recent_codes = {}
+        self.visible_codes = []
+
+    def setup(self, server):
+        super().setup(server)
+        self.scan_scale = Config.get("qr_code_scan_scale")
+        self.scan_rate = Config.get("qr_code_scan_rate")
+        self.code_ttl = Config.get("qr_code_ttl")
+        try:
+            self.scan_region = tuple(float(v) for v in Config.get("qr_code_scan_region").split(":"))
+        except ValueError:
+            logger.error(f"Invalid QR code scan region {Config.get('qr_code_scan_region')}")
+            self.scan_region = (0, 0, 100, 100)
 
     async def process(self, message, protocol):
         if message["action"] == "toggle":
@@ -22,12 +46,64 @@ class QRCodeHandler(BaseHandler):
             self.running = True
         elif message["action"] == "stop":
             self.running = False
+        if not self.running:
+            self.visible_codes = []
+
+    def wants_event(self, topic, event_type):
+        return self.running
 
     def receive_event(self, topic, event_type, data):
         if self.running and topic == "camera" and event_type == "new_front_camera_frame" and len(data["frame"]) > 0:
-            if self.frame_counter % Camera.frame_rate == 0:
-                decoded_info, points, _ = self.detector.detectAndDecode(data["frame"])
-                if points is not None:
-                    print(decoded_info)
+            now = time.time()
+            if not self.detection_pending and now - self.last_scan_ts >= 1.0 / max(1, self.scan_rate):
+                self.last_scan_ts = now
+                self.scan(data["envelope"])
             self.frame_counter += 1
 
+    def scan(self, frame):
+        # Scan the configured region (x:y:w:h in % of the frame) of the downscaled gray image, in the vision workers
+        image = frame.get_image(scale=self.scan_scale, gray=True)
+        x, y, w, h = self.scan_region
+        res_y, res_x = image.shape[:2]
+        left, top = int(x * res_x / 100), int(y * res_y / 100)
+        right, bottom = min(res_x, int((x + w) * res_x / 100)), min(res_y, int((y + h) * res_y / 100))
+        if right <= left or bottom <= top:
+            return
+        self.detection_pending = True
+        if not VisionExecutor.submit(
+            "decode_qr_codes",
+            image[top:bottom, left:right],
+            functools.partial(self.qr_codes_decoded, frame.sequence, left, top),
+        ):
+            self.detection_pending = False
+
+    def qr_codes_decoded(self, sequence, left, top, codes):
+        # Called by the vision executor once the scan is completed
+        self.detection_pending = False
+        if codes is None:
+            return
+        # Corners in full resolution frame coordinates
+        self.visible_codes = [
+            dict(
+                data=data,
+                corners=[[int((left + cx) * self.scan_scale), int((top + cy) * self.scan_scale)] for cx, cy in corners],
+            )
+            for data, corners in codes
+        ]
+        if len(codes) == 0:
+            return
+        now = time.time()
+        # Forget the codes not seen for a while
+        self.recent_codes = {data: ts for data, ts in self.recent_codes.items() if now - ts < self.code_ttl}
+        new_codes = [code for code in self.visible_codes if code["data"] not in self.recent_codes]
+        for data, _ in codes:
+            self.recent_codes[data] = now
+        if len(new_codes) > 0:
+            logger.info(f"New QR codes: {', '.join(code['data'] for code in new_codes)}")
+            self.server.broadcast_message("qr_code", dict(sequence=sequence, codes=new_codes))
+
+    def get_handler_telemetry(self):
+        # Codes found by the last scan
+        if self.running and len(self.visible_codes) > 0:
+            return dict(codes=self.visible_codes)
+        return None
@@ -3,6 +3,7 @@ import asyncio
 import logging
 import sys
 
+from benchmark import run_benchmark
 from models import Config
 from prettytable import PrettyTable
 from server import Server
@@ -70,12 +71,32 @@ if __name__ == "__main__":
     parser_configure.add_argument('key', type=str, nargs='?')
     parser_configure.add_argument('value', type=str, nargs='?')
 
+    # Camera pipeline benchmark parameters
+    parser_benchmark = subparsers.add_parser('benchmark')
+    parser_benchmark.add_argument('--device', choices=["synthetic", "replay", "usb", "picamera"], default="synthetic")
+    parser_benchmark.add_argument('--source', type=str, help='Video file or image directory to replay')
+    parser_benchmark.add_argument('--duration', type=float, default=10, help='Duration of the measure in seconds')
+    parser_benchmark.add_argument('--frame-rate', type=int)
+    parser_benchmark.add_argument('--resolution', type=str, help='e.g. 1280x720')
+    parser_benchmark.add_argument('--hud', choices=["server", "client", "none"])
+    parser_benchmark.add_argument('--tiers', nargs='*', default=["full"], help='Encoding tier of each viewer')
+    parser_benchmark.add_argument('--handlers', nargs='*', default=[], help='Handlers to start, e.g. face_detection')
+
     args = parser.parse_args()
 
     Config.setup(args.config)
 
     if args.command == "runserver":
         asyncio.run(start_server())
+    elif args.command == "benchmark":
+        if args.device == "replay" and not args.source:
+            print(f"Missing source for replay")
+            parser.print_usage()
+        else:
+            run_benchmark(
+                args.device, args.source, args.duration, args.frame_rate, args.resolution, args.hud, args.tiers,
+                args.handlers
+            )
     elif args.command == "configuration":
         if args.action == "update" and not args.value:
             print(f"Missing value for update")
@@ -31,6 +31,8 @@ class Config(Base):
     db_engine = None
     db_session = None
     user_config = None
+    # Values set for the running process only, e.g. by the benchmark, never saved in the DB
+    overrides = {}
 
     __tablename__ = 'server_config'
 
@@ -124,6 +126,8 @@ class Config(Base):
         config = Config.CONFIG_KEYS.get(key)
         if config is None:
             raise KeyError(key)
+        elif key in Config.overrides:
+            return Config.overrides[key]
         else:
             session = Config.get_session()
             c = Config.get_from_db(session, key)
@@ -131,6 +135,13 @@ class Config(Base):
                 return Config._convert_to_type(c.value, config.get("type"))
         return config.get("default")
 
+    @staticmethod
+    def override(key, value):
+        config = Config.CONFIG_KEYS.get(key)
+        if config is None:
+            raise KeyError(key)
+        Config.overrides[key] = Config._convert_to_type(value, config.get("type"))
+
     @staticmethod
     def get_video_server_port():
         return int(Config.user_config.get("pirobot", "video_server_port"))
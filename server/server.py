@@ -8,7 +8,10 @@ from motor.motor import Motor
 from sfx import SFX
 from terminal import Terminal
 from uart import UART
+from video.media_writer import MediaWriter
+from video.vision import VisionExecutor
 
+import asyncio
 import logging
 import platform
 import pyttsx3
@@ -33,6 +36,8 @@ class Server(object):
         self.lcd = None
         self.terminal = None
         self.voice_engine = None
+        self.loop = None
+        self.protocols = set()
 
     def setup(self):
         # Open UART Port
@@ -70,6 +75,8 @@ class Server(object):
 
         # Camera Initialization
         Camera.setup()
+        VisionExecutor.setup(Config.get("vision_workers"))
+        MediaWriter.setup(Config.get("video_writer_queue_size"))
         if self.robot_has_screen:
             self.terminal.text(f"Camera setup.. {Camera.status}")
 
@@ -85,11 +92,28 @@ class Server(object):
         for handler in BaseHandler.get_handler_for_message_type(message["type"]):
             await handler.process(message, protocol)
 
-    def connection_lost(self):
+    def connection_made(self, protocol):
+        self.loop = asyncio.get_running_loop()
+        self.protocols.add(protocol)
+
+    def connection_lost(self, protocol):
+        self.protocols.discard(protocol)
         # Stop the robot in case of lost connection
         logger.warning("Client connection lost, stopping robot")
         Motor.stop()
 
+    def broadcast_message(self, topic, message):
+        # Send a message to all the connected clients, can be called from any thread
+        if self.loop is not None and not self.loop.is_closed():
+            asyncio.run_coroutine_threadsafe(self.send_message_to_all(topic, message), self.loop)
+
+    async def send_message_to_all(self, topic, message):
+        for protocol in list(self.protocols):
+            try:
+                await protocol.send_message(topic, message)
+            except ConnectionResetError:
+                self.protocols.discard(protocol)
+
     async def send_status(self, protocol):
         status = {
             "type": "status",
@@ -101,3 +125,11 @@ class Server(object):
         }
         await protocol.send_message("status", status)
 
+    async def send_camera_status(self, protocol):
+        # Sent after each camera move. The clients of the binary protocol only get the camera part of the status, the
+        # other ones the full status.
+        if protocol.binary:
+            await protocol.send_message("camera_status", Camera.serialize())
+        else:
+            await self.send_status(protocol)
+
@@ -0,0 +1,110 @@
+import struct
+
+AVIF_HASINDEX = 0x10
+AVIIF_KEYFRAME = 0x10
+FRAME_CHUNK_ID = b"00dc"
+
+
+class MJPEGAVIWriter(object):
+    # Writes already encoded JPEG frames in an AVI/MJPEG container, without decoding them. Each frame is a chunk of the
+    # movi list, the idx1 index written on release lets the players seek. Sizes and frame counts of the headers are
+    # patched on release. AVI 1.0 only, sizes are 32 bits so files are limited to 4GB.
+
+    def __init__(self, filename, frame_rate, width, height):
+        self.file = open(filename, "wb")
+        self.frame_rate = frame_rate
+        self.width = width
+        self.height = height
+        self.index = []
+        self.max_frame_size = 0
+        self.nb_of_bytes = 0
+        self.write_headers()
+
+    def write_headers(self):
+        # RIFF AVI header, sizes are patched on release
+        self.file.write(b"RIFF" + struct.pack("<I", 0) + b"AVI ")
+        avih = struct.pack(
+            "<14I",
+            int(1000000 / self.frame_rate),  # Micro seconds per frame
+            0,  # Max bytes per second
+            0,  # Padding granularity
+            AVIF_HASINDEX,
+            0,  # Total frames
+            0,  # Initial frames
+            1,  # Streams
+            0,  # Suggested buffer size
+            self.width,
+            self.height,
+            0, 0, 0, 0,
+        )
+        strh = b"vidsMJPG" + struct.pack(
+            "<IHHIIIIIIIIhhhh",
+            0,  # Flags
+            0,  # Priority
+            0,  # Language
+            0,  # Initial frames
+            1000,  # Scale
+            int(self.frame_rate * 1000),  # Rate, frame rate = rate / scale
+            0,  # Start
+            0,  # Length, in frames
+            0,  # Suggested buffer size
+            0xFFFFFFFF,  # Quality, default
+            0,  # Sample size, 0 for video
+            0, 0, self.width, self.height,
+        )
+        strf = struct.pack(
+            "<IiiHH4sIiiII", 40, self.width, self.height, 1, 24, b"MJPG", self.width * self.height * 3, 0, 0, 0, 0
+        )
+        strl = b"strl" + self.chunk(b"strh", strh) + self.chunk(b"strf", strf)
+        hdrl = b"hdrl" + self.chunk(b"avih", avih) + self.chunk(b"LIST", strl)
+        self.file.write(self.chunk(b"LIST", hdrl))
+        self.avih_offset = 12 + 8 + 4 + 8
+        self.strh_offset = self.avih_offset + len(avih) + 8 + 4 + 8
+        self.movi_offset = self.file.tell()
+        self.file.write(b"LIST" + struct.pack("<I", 0) + b"movi")
+
+    @staticmethod
+    def chunk(chunk_id, data):
+        if len(data) % 2 == 1:
+            data += b"\0"
+        return chunk_id + struct.pack("<I", len(data)) + data
+
+    def write(self, data, count=1):
+        # Writes a JPEG frame, count times to fill a gap in the capture
+        offset = self.file.tell() - self.movi_offset - 8
+        chunk = self.chunk(FRAME_CHUNK_ID, data)
+        for i in range(count):
+            self.file.write(chunk)
+            self.index.append((offset + i * len(chunk), len(data)))
+        self.max_frame_size = max(self.max_frame_size, len(data))
+        self.nb_of_bytes += count * len(data)
+
+    def release(self):
+        if self.file is None:
+            return
+        movi_end = self.file.tell()
+        self.file.write(b"idx1" + struct.pack("<I", 16 * len(self.index)))
+        self.file.write(
+            b"".join(
+                FRAME_CHUNK_ID + struct.pack("<III", AVIIF_KEYFRAME, offset, size) for offset, size in self.index
+            )
+        )
+        file_end = self.file.tell()
+        nb_of_frames = len(self.index)
+        duration = nb_of_frames / self.frame_rate
+        max_bytes_per_sec = int(self.nb_of_bytes / duration) if duration > 0 else 0
+        # Patch the sizes and the counts
+        self.file.seek(4)
+        self.file.write(struct.pack("<I", file_end - 8))
+        self.file.seek(self.avih_offset + 4)
+        self.file.write(struct.pack("<I", max_bytes_per_sec))
+        self.file.seek(self.avih_offset + 16)
+        self.file.write(struct.pack("<I", nb_of_frames))
+        self.file.seek(self.avih_offset + 28)
+        self.file.write(struct.pack("<I", self.max_frame_size))
+        self.file.seek(self.strh_offset + 32)
+        self.file.write(struct.pack("<II", nb_of_frames, self.max_frame_size))
+        self.file.seek(self.movi_offset + 4)
+        self.file.write(struct.pack("<I", movi_end - self.movi_offset - 8))
+        self.file.close()
+        self.file = None
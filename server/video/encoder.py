@@ -0,0 +1,274 @@
+import cv2
+import logging
+import threading
+import time
+
+from video.stats import pipeline_stats
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIER = "full"
+
+
+# Bounds of the output size of a region of interest, in pixels
+MIN_ROI_SIZE = 16
+MAX_ROI_SIZE = (1920, 1080)
+
+
+class EncodingTier(object):
+    __slots__ = ("name", "scale", "quality", "crop", "size")
+
+    def __init__(self, name, scale, quality, crop=None, size=None):
+        self.name = name
+        self.scale = scale  # in % of the captured resolution
+        self.quality = quality  # JPEG quality, 0 to 100
+        # Region of interest: x, y, width, height in % of the frame, scaled to size (width, height in pixels) if set
+        self.crop = crop
+        self.size = size
+
+    @staticmethod
+    def parse(tiers_config):
+        # Format: name:scale:quality, comma separated. e.g. full:100:95,low:25:70
+        tiers = []
+        for tier_config in tiers_config.split(","):
+            try:
+                name, scale, quality = tier_config.strip().split(":")
+                tiers.append(EncodingTier(name, int(scale), int(quality)))
+            except ValueError:
+                logger.error(f"Invalid encoding tier {tier_config}")
+        if DEFAULT_TIER not in [tier.name for tier in tiers]:
+            tiers.append(EncodingTier(DEFAULT_TIER, 100, 95))
+        return tiers
+
+
+class EncodedFrame(object):
+    # JPEG encoded frame, shared between all the subscribers of a tier
+    __slots__ = ("sequence", "timestamp", "tier", "width", "height", "data", "telemetry", "stamps")
+
+    def __init__(self, sequence, timestamp, tier, width, height, data, telemetry=None, stamps=None):
+        self.sequence = sequence
+        self.timestamp = timestamp
+        self.tier = tier
+        self.width = width
+        self.height = height
+        self.data = data
+        self.telemetry = telemetry
+        self.stamps = stamps if stamps is not None else {}
+
+
+class FrameEncoder(object):
+    # Encoding stage of the camera pipeline. The capture thread submits frames, a pool of workers encode each frame once
+    # per tier having subscribers and share the result with all of them. If the workers are busy, only the latest
+    # submitted frame is kept and the older one is dropped. Followers get the frames of the largest configured tier
+    # encoded for the subscribers, they never cause a frame to be encoded. Frames without annotations are encoded from
+    # the raw frame, or not encoded at all when the device captured them as JPEG.
+
+    def __init__(self, tiers, workers=2):
+        self.tiers = {tier.name: tier for tier in tiers}
+        self.nb_of_workers = max(1, workers)
+        self.workers = []
+        self.subscribers = {}
+        self.followers = {}
+        self.subscribers_lock = threading.Lock()
+        self.condition = threading.Condition()
+        self.pending_frame = None
+        self.last_sequence = {}
+        self.latest = {}
+        self.delivery_lock = threading.Lock()
+        self.nb_of_encoded_frames = {}
+        self.nb_of_dropped_frames = 0
+        # Tiers of the regions of interest requested by the clients: name -> number of clients using it
+        self.roi_references = {}
+
+    def set_tiers(self, tiers):
+        with self.subscribers_lock:
+            roi_tiers = {name: self.tiers[name] for name in self.roi_references}
+            self.tiers = {tier.name: tier for tier in tiers}
+            self.tiers.update(roi_tiers)
+
+    def get_configured_tiers(self):
+        with self.subscribers_lock:
+            return [tier for name, tier in self.tiers.items() if name not in self.roi_references]
+
+    def add_roi_tier(self, crop, size=None, quality=95):
+        # Tier encoding a region of the frame, shared by the clients requesting the same region. Returns its name, it
+        # must be released with remove_roi_tier when not used anymore.
+        if len(crop) != 4:
+            raise ValueError(f"Invalid region of interest {crop}")
+        # Rounded so that close regions share the same tier
+        x, y = [round(min(max(float(v), 0.0), 99.0), 1) for v in crop[:2]]
+        width = round(min(max(float(crop[2]), 1.0), 100 - x), 1)
+        height = round(min(max(float(crop[3]), 1.0), 100 - y), 1)
+        name = f"roi_{x}_{y}_{width}_{height}_{quality}"
+        if size is not None:
+            if len(size) != 2:
+                raise ValueError(f"Invalid output size {size}")
+            size = tuple(min(max(int(v), MIN_ROI_SIZE), max_v) for v, max_v in zip(size, MAX_ROI_SIZE))
+            name += f"_{size[0]}x{size[1]}"
+        with self.subscribers_lock:
+            if name not in self.tiers:
+                self.tiers[name] = EncodingTier(name, 100, quality, crop=(x, y, width, height), size=size)
+            self.roi_references[name] = self.roi_references.get(name, 0) + 1
+        return name
+
+    def remove_roi_tier(self, name):
+        with self.subscribers_lock:
+            references = self.roi_references.get(name, 0) - 1
+            if references > 0:
+                self.roi_references[name] = references
+                return
+            self.roi_references.pop(name, None)
+            self.tiers.pop(name, None)
+        with self.delivery_lock:
+            self.last_sequence.pop(name, None)
+            self.latest.pop(name, None)
+            self.nb_of_encoded_frames.pop(name, None)
+
+    def start(self):
+        self.workers = [w for w in self.workers if w.is_alive()]
+        for _ in range(self.nb_of_workers - len(self.workers)):
+            worker = threading.Thread(target=self.run, daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def add_subscriber(self, name, callback, tier=DEFAULT_TIER):
+        with self.subscribers_lock:
+            if tier not in self.tiers:
+                logger.warning(f"Unknown encoding tier {tier}, using {DEFAULT_TIER}")
+                tier = DEFAULT_TIER
+            self.remove_subscriber_unlocked(name)
+            self.subscribers.setdefault(tier, {})[name] = callback
+
+    def add_follower(self, name, callback):
+        with self.subscribers_lock:
+            self.remove_subscriber_unlocked(name)
+            self.followers[name] = callback
+
+    def remove_subscriber(self, name):
+        with self.subscribers_lock:
+            self.remove_subscriber_unlocked(name)
+
+    def remove_subscriber_unlocked(self, name):
+        self.followers.pop(name, None)
+        for tier_name in list(self.subscribers.keys()):
+            self.subscribers[tier_name].pop(name, None)
+            if len(self.subscribers[tier_name]) == 0:
+                del self.subscribers[tier_name]
+
+    def has_subscribers(self):
+        return len(self.subscribers) > 0
+
+    def submit(self, frame):
+        if not self.has_subscribers():
+            return
+        if len(self.workers) < self.nb_of_workers:
+            self.start()
+        frame.pin()
+        with self.condition:
+            dropped_frame = self.pending_frame
+            self.pending_frame = frame
+            self.condition.notify()
+        if dropped_frame is not None:
+            self.nb_of_dropped_frames += 1
+            dropped_frame.release()
+
+    def run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.pending_frame is not None)
+                frame = self.pending_frame
+                self.pending_frame = None
+            try:
+                self.encode(frame)
+            except Exception:
+                logger.error("Unexpected exception while encoding frame", exc_info=True)
+            finally:
+                frame.release()
+
+    def encode(self, frame):
+        with self.subscribers_lock:
+            tiers = [self.tiers[tier_name] for tier_name in self.subscribers.keys() if tier_name in self.tiers]
+        # Regions of interest are not the whole frame, they are never followed
+        followed_tier = max(
+            (tier for tier in tiers if tier.crop is None), key=lambda tier: (tier.scale, tier.quality), default=None
+        )
+        for tier in tiers:
+            with pipeline_stats.measure("encode"):
+                if not frame.is_annotated and frame.jpeg is not None and tier.scale == 100 and tier.crop is None:
+                    # Nothing drawn on the frame, stream the JPEG captured by the device as is
+                    height, width = frame.shape[:2]
+                    data = frame.jpeg.tobytes()
+                else:
+                    image = frame.annotated if frame.is_annotated else frame.raw
+                    if tier.crop is not None:
+                        image = self.crop(image, tier)
+                    elif tier.scale != 100:
+                        image = cv2.resize(
+                            image,
+                            (image.shape[1] * tier.scale // 100, image.shape[0] * tier.scale // 100),
+                            interpolation=cv2.INTER_AREA,
+                        )
+                    height, width = image.shape[:2]
+                    data = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, tier.quality])[1].tobytes()
+            self.deliver(
+                EncodedFrame(
+                    sequence=frame.sequence,
+                    timestamp=frame.timestamp,
+                    tier=tier.name,
+                    width=width,
+                    height=height,
+                    data=data,
+                    telemetry=frame.telemetry,
+                    stamps=dict(frame.stamps, encode=time.time()),
+                ),
+                followed=tier is followed_tier,
+            )
+
+    @staticmethod
+    def crop(image, tier):
+        res_y, res_x = image.shape[:2]
+        x, y, width, height = tier.crop
+        x_offset, y_offset = int(x * res_x / 100), int(y * res_y / 100)
+        width, height = max(1, int(width * res_x / 100)), max(1, int(height * res_y / 100))
+        image = image[y_offset:y_offset + height, x_offset:x_offset + width]
+        if tier.size is None or tier.size == (image.shape[1], image.shape[0]):
+            return image
+        # Zooming in needs interpolation, zooming out needs averaging
+        interpolation = cv2.INTER_LINEAR if tier.size[0] > image.shape[1] else cv2.INTER_AREA
+        return cv2.resize(image, tier.size, interpolation=interpolation)
+
+    def deliver(self, encoded_frame, followed=False):
+        with self.delivery_lock:
+            # Workers may complete out of order, never deliver an older frame
+            if encoded_frame.sequence <= self.last_sequence.get(encoded_frame.tier, -1):
+                return
+            self.last_sequence[encoded_frame.tier] = encoded_frame.sequence
+            self.latest[encoded_frame.tier] = encoded_frame
+            self.nb_of_encoded_frames[encoded_frame.tier] = self.nb_of_encoded_frames.get(encoded_frame.tier, 0) + 1
+        with self.subscribers_lock:
+            callbacks = list(self.subscribers.get(encoded_frame.tier, {}).values())
+            if followed:
+                callbacks += self.followers.values()
+        with pipeline_stats.measure("fanout"):
+            for callback in callbacks:
+                callback(encoded_frame)
+
+    def get_latest(self, tier=DEFAULT_TIER):
+        return self.latest.get(tier)
+
+    def serialize(self):
+        return {
+            'tiers': {
+                name: dict(
+                    scale=tier.scale,
+                    quality=tier.quality,
+                    crop=tier.crop,
+                    size=tier.size,
+                    subscribers=len(self.subscribers.get(name, {})),
+                    encoded_frames=self.nb_of_encoded_frames.get(name, 0),
+                )
+                for name, tier in self.tiers.items()
+            },
+            'followers': len(self.followers),
+            'dropped_frames': self.nb_of_dropped_frames,
+        }
@@ -0,0 +1,234 @@
+import cv2
+import itertools
+import threading
+
+import numpy as np
+
+PYRAMID_SCALES = (1, 2, 4)
+# Sequence of the analysis images provided by the capture device until the frame is published
+PENDING_SEQUENCE = -2
+# Start of frame markers, holding the size of the image
+JPEG_SOF_MARKERS = (0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF)
+
+
+def get_jpeg_shape(data):
+    # Shape of the decoded JPEG image, read from its headers without decoding it. None if the headers are invalid.
+    data = memoryview(data).cast("B")
+    if len(data) < 4 or data[0] != 0xFF or data[1] != 0xD8:
+        return None
+    position = 2
+    while position + 9 <= len(data):
+        if data[position] != 0xFF:
+            return None
+        marker = data[position + 1]
+        if marker in JPEG_SOF_MARKERS:
+            height = (data[position + 5] << 8) + data[position + 6]
+            width = (data[position + 7] << 8) + data[position + 8]
+            return height, width, 3
+        position += 2 + (data[position + 2] << 8) + data[position + 3]
+    return None
+
+
+class Frame(object):
+    # Envelope of a captured frame. Frames are recycled by a FrameRing, so consumers must not keep a reference to the
+    # buffers after the next frames have been captured, unless they pinned the frame.
+    # Frames captured as JPEG by the device are only decoded when their pixels are accessed, the JPEG data can be
+    # streamed as is otherwise.
+    __slots__ = (
+        "sequence", "timestamp", "device", "annotated", "is_annotated", "telemetry", "stamps", "_raw", "_buffer", "_jpeg",
+        "_decoded", "_decode_lock", "_pins", "_ring", "_analysis", "_analysis_lock"
+    )
+
+    def __init__(self, shape, ring):
+        self.sequence = -1
+        self.timestamp = 0.0
+        self.device = ring.device
+        self._ring = ring
+        self._buffer = np.zeros(shape, dtype=np.uint8)
+        # Consumers only get a read only view of the raw frame, the HUD is drawn in the annotated buffer
+        self._raw = self._buffer.view()
+        self._raw.flags.writeable = False
+        self._jpeg = None
+        self._decoded = True
+        self._decode_lock = threading.Lock()
+        self.annotated = np.zeros(shape, dtype=np.uint8)
+        self.is_annotated = False
+        # Data the client needs to draw the HUD of this frame
+        self.telemetry = None
+        # Time the frame went through each stage of the pipeline after its capture: stage -> timestamp
+        self.stamps = {}
+        self._pins = 0
+        # Analysis images, computed on demand and cached for the current sequence: key -> (sequence, image)
+        self._analysis = {}
+        self._analysis_lock = threading.Lock()
+
+    @property
+    def shape(self):
+        return self._buffer.shape
+
+    @property
+    def buffer(self):
+        # Writable raw buffer, only used by the capture device
+        return self._buffer
+
+    @property
+    def raw(self):
+        if not self._decoded:
+            with self._decode_lock:
+                if not self._decoded:
+                    image = cv2.imdecode(self._jpeg, cv2.IMREAD_COLOR)
+                    if image is not None and image.shape == self._buffer.shape:
+                        np.copyto(self._buffer, image)
+                    self._decoded = True
+        return self._raw
+
+    @property
+    def is_decoded(self):
+        return self._decoded
+
+    @property
+    def jpeg(self):
+        # JPEG data captured by the device, None if the device captured the pixels
+        return self._jpeg
+
+    def set_jpeg(self, data):
+        # Called by the capture device before publishing the frame, data is None for frames captured as pixels
+        self._jpeg = data
+        self._decoded = data is None
+
+    def pin(self):
+        # Prevent the ring from recycling the frame until it is released
+        with self._ring.lock:
+            self._pins += 1
+        return self
+
+    def release(self):
+        with self._ring.lock:
+            self._pins = max(0, self._pins - 1)
+
+    def get_image(self, scale=1, gray=False):
+        # Analysis pyramid shared by all the vision handlers: the raw frame downscaled by 1, 2 or 4, in color or gray.
+        # Each image is computed at most once per frame, from the previous level, into a buffer reused by the next
+        # frames. Coordinates found in a downscaled image must be multiplied by the scale.
+        if scale not in PYRAMID_SCALES:
+            raise ValueError(f"Invalid pyramid scale {scale}")
+        if scale == 1 and not gray:
+            return self.raw
+        with self._analysis_lock:
+            return self._get_image(scale, gray)
+
+    def _get_image(self, scale, gray):
+        if scale == 1 and not gray:
+            return self.raw
+        key = (scale, gray)
+        sequence, buffer, image = self._analysis.get(key, (None, None, None))
+        if sequence == self.sequence:
+            return image
+        if scale == 1:
+            source = self.raw
+            size = (source.shape[1], source.shape[0])
+        else:
+            source = self._get_image(scale // 2, gray)
+            size = (source.shape[1] // 2, source.shape[0] // 2)
+        if buffer is None or buffer.shape[:2] != (size[1], size[0]):
+            buffer = np.empty((size[1], size[0]) if gray else (size[1], size[0], 3), dtype=np.uint8)
+            image = buffer.view()
+            image.flags.writeable = False
+        if scale == 1:
+            cv2.cvtColor(source, cv2.COLOR_BGR2GRAY, dst=buffer)
+        else:
+            cv2.resize(source, size, dst=buffer, interpolation=cv2.INTER_AREA)
+        self._analysis[key] = (self.sequence, buffer, image)
+        return image
+
+    def set_analysis_image(self, scale, gray, image):
+        # Pyramid image provided by the capture device, e.g. scaled by the camera ISP, so that it is not computed from
+        # the raw frame. Must be called before the frame is published.
+        key = (scale, gray)
+        with self._analysis_lock:
+            _, buffer, view = self._analysis.get(key, (None, None, None))
+            if buffer is None or buffer.shape != image.shape:
+                buffer = np.empty(image.shape, dtype=np.uint8)
+                view = buffer.view()
+                view.flags.writeable = False
+            np.copyto(buffer, image)
+            self._analysis[key] = (PENDING_SEQUENCE, buffer, view)
+
+    def prepare_annotation(self):
+        np.copyto(self.annotated, self.raw)
+        self.is_annotated = True
+        return self.annotated
+
+
+class FrameRing(object):
+    DEFAULT_SIZE = 4
+    # Sequence numbers are shared by all the rings, so they stay monotonic when the streamed device changes
+    sequence_counter = itertools.count(1)
+
+    def __init__(self, shape, device=None, size=DEFAULT_SIZE):
+        self.device = device
+        self.size = size
+        self.sequence = 0
+        self.index = 0
+        self.latest_frame = None
+        self.lock = threading.Lock()
+        self.new_frame = threading.Condition(self.lock)
+        self.frames = [Frame(shape, self) for _ in range(size)]
+
+    @property
+    def shape(self):
+        return self.frames[0].shape
+
+    def resize(self, shape):
+        with self.lock:
+            self.frames = [Frame(shape, self) for _ in range(self.size)]
+            self.index = 0
+            self.latest_frame = None
+
+    def acquire(self):
+        # Return the next frame to be filled by the capture device, skipping the latest frame and the frames pinned by
+        # slow consumers. The capture never waits for a consumer: if all the frames are in use, the slot is replaced by a
+        # new frame and the pinned one is left to its consumer.
+        with self.lock:
+            for _ in range(self.size):
+                self.index = (self.index + 1) % self.size
+                frame = self.frames[self.index]
+                if frame is not self.latest_frame and frame._pins == 0:
+                    return frame
+            frame = Frame(self.shape, self)
+            self.frames[self.index] = frame
+            return frame
+
+    def publish(self, frame, timestamp):
+        with self.lock:
+            self.sequence = next(FrameRing.sequence_counter)
+            frame.sequence = self.sequence
+            frame.timestamp = timestamp
+            frame.is_annotated = False
+            frame.telemetry = None
+            frame.stamps = {}
+            for key, (sequence, buffer, image) in list(frame._analysis.items()):
+                if sequence == PENDING_SEQUENCE:
+                    frame._analysis[key] = (self.sequence, buffer, image)
+            self.latest_frame = frame
+            self.new_frame.notify_all()
+
+    def latest(self, pin=False):
+        with self.lock:
+            frame = self.latest_frame
+            if pin and frame is not None:
+                frame._pins += 1
+            return frame
+
+    def wait_for_frame(self, after_sequence, timeout=None, pin=False):
+        # Wait for a frame newer than after_sequence, slow consumers get the latest frame and skip the others
+        with self.lock:
+            self.new_frame.wait_for(
+                lambda: self.latest_frame is not None and self.latest_frame.sequence > after_sequence, timeout=timeout
+            )
+            frame = self.latest_frame
+            if frame is None or frame.sequence <= after_sequence:
+                return None
+            if pin:
+                frame._pins += 1
+            return frame
@@ -0,0 +1,191 @@
+import cv2
+import math
+import numpy as np
+import threading
+
+HUD_COLOR = (0, 255, 0)
+HUD_THICKNESS = 2
+HUD_FONT = cv2.FONT_HERSHEY_SIMPLEX
+HUD_FONT_SCALE = 0.8
+# Where the HUD is drawn: server draws it in the streamed frames, client sends the telemetry with each frame for the
+# client to draw it, none streams the frames as captured
+HUD_MODE_SERVER = "server"
+HUD_MODE_CLIENT = "client"
+HUD_MODE_NONE = "none"
+
+
+class HUDLayer(object):
+    # Static part of the HUD, rendered once into a colour image plus a mask, limited to its bounding box, and blended in
+    # a single vectorized operation
+    __slots__ = ("region", "color", "mask")
+
+    def __init__(self, res_x, res_y, draw):
+        image = np.zeros((res_y, res_x, 3), dtype=np.uint8)
+        draw(image)
+        mask = image.any(axis=2)
+        rows = np.flatnonzero(mask.any(axis=1))
+        cols = np.flatnonzero(mask.any(axis=0))
+        if len(rows) == 0:
+            self.region = (slice(0, 0), slice(0, 0))
+        else:
+            self.region = (slice(rows[0], rows[-1] + 1), slice(cols[0], cols[-1] + 1))
+        self.color = np.ascontiguousarray(image[self.region])
+        self.mask = np.ascontiguousarray(mask[self.region], dtype=np.uint8)
+
+    def blend(self, frame):
+        if self.mask.size > 0:
+            cv2.copyTo(self.color, self.mask, frame[self.region])
+
+
+class TextTile(object):
+    # Pre-rendered text, only re-rendered when its value changes
+    __slots__ = ("text", "color", "image", "mask", "width", "height", "padding")
+
+    def __init__(self, text, color):
+        self.text = text
+        self.color = color
+        self.padding = HUD_THICKNESS
+        (self.width, self.height), baseline = cv2.getTextSize(
+            text=text, fontFace=HUD_FONT, fontScale=HUD_FONT_SCALE, thickness=HUD_THICKNESS
+        )
+        self.image = np.zeros(
+            (self.height + baseline + 2 * self.padding, self.width + 2 * self.padding, 3), dtype=np.uint8
+        )
+        cv2.putText(
+            self.image,
+            text,
+            (self.padding, self.padding + self.height),
+            HUD_FONT,
+            HUD_FONT_SCALE,
+            color,
+            HUD_THICKNESS,
+        )
+        self.mask = self.image.any(axis=2).astype(np.uint8)
+
+    def blit(self, frame, x, y):
+        # (x, y) is the origin of the text as for cv2.putText, clip the tile to the frame
+        top, left = y - self.height - self.padding, x - self.padding
+        tile_top, tile_left = max(0, -top), max(0, -left)
+        bottom = min(frame.shape[0], top + self.image.shape[0])
+        right = min(frame.shape[1], left + self.image.shape[1])
+        if bottom <= max(0, top) or right <= max(0, left):
+            return
+        tile_bottom = tile_top + bottom - max(0, top)
+        tile_right = tile_left + right - max(0, left)
+        cv2.copyTo(
+            self.image[tile_top:tile_bottom, tile_left:tile_right],
+            self.mask[tile_top:tile_bottom, tile_left:tile_right],
+            frame[max(0, top):bottom, max(0, left):right],
+        )
+
+
+class HUDCompositor(object):
+    compositors = {}
+    compositors_lock = threading.Lock()
+
+    @staticmethod
+    def get(res_x, res_y):
+        with HUDCompositor.compositors_lock:
+            compositor = HUDCompositor.compositors.get((res_x, res_y))
+            if compositor is None:
+                compositor = HUDCompositor(res_x, res_y)
+                HUDCompositor.compositors[(res_x, res_y)] = compositor
+            return compositor
+
+    @staticmethod
+    def for_frame(frame):
+        return HUDCompositor.get(frame.shape[1], frame.shape[0])
+
+    def __init__(self, res_x, res_y):
+        self.res_x = res_x
+        self.res_y = res_y
+        self.radar_radius = 0.15 * res_x
+        self.text_height = cv2.getTextSize(
+            text="ODO", fontFace=HUD_FONT, fontScale=HUD_FONT_SCALE, thickness=HUD_THICKNESS
+        )[0][1]
+        self.text_tiles = {}
+        self.text_tiles_lock = threading.Lock()
+        self.navigation_layer = HUDLayer(res_x, res_y, self.draw_static_navigation)
+        self.radar_layer = HUDLayer(res_x, res_y, self.draw_static_radar)
+
+    def draw_static_navigation(self, frame):
+        # Visor
+        radius = 30
+        y_offest = 30
+        center_x = self.res_x // 2
+        center_y = self.res_y // 2 + y_offest
+        cv2.line(frame, (center_x, center_y + (radius + 10)), (center_x, center_y - (radius + 10)), HUD_COLOR, HUD_THICKNESS)
+        cv2.line(frame, (center_x + (radius + 10), center_y), (center_x - (radius + 10), center_y), HUD_COLOR, HUD_THICKNESS)
+        cv2.circle(frame, (center_x, center_y), radius, HUD_COLOR, HUD_THICKNESS)
+
+        # Path
+        path_bottom = 100
+        cv2.line(frame, (center_x, center_y), (path_bottom, self.res_y), HUD_COLOR, HUD_THICKNESS)
+        cv2.line(frame, (center_x, center_y), (self.res_x - path_bottom, self.res_y), HUD_COLOR, HUD_THICKNESS)
+
+        # Speed bars
+        cv2.rectangle(frame, (5, self.res_y - 50), (5 + 40, self.res_y - 50 - 400), HUD_COLOR, HUD_THICKNESS)
+        cv2.rectangle(frame, (self.res_x - 5, self.res_y - 50), (self.res_x - 5 - 40, self.res_y - 50 - 400), HUD_COLOR, HUD_THICKNESS)
+
+    def draw_static_radar(self, frame):
+        center = (self.res_x // 2, self.res_y)
+        radius = self.radar_radius
+        for ring_radius in [radius, 2 * radius / 3, radius / 3]:
+            cv2.circle(frame, center, radius=int(ring_radius), color=HUD_COLOR, thickness=HUD_THICKNESS)
+        for angle in [-math.pi / 4, 0, math.pi / 4]:
+            cv2.line(
+                frame,
+                center,
+                (int(self.res_x // 2 + radius * math.sin(angle)), int(self.res_y - radius * math.cos(angle))),
+                HUD_COLOR,
+                HUD_THICKNESS,
+            )
+
+    def draw_text(self, frame, key, text, position, align="left", color=HUD_COLOR):
+        with self.text_tiles_lock:
+            tile = self.text_tiles.get(key)
+            if tile is None or tile.text != text or tile.color != color:
+                tile = TextTile(text, color)
+                self.text_tiles[key] = tile
+        x, y = position
+        if align == "right":
+            x -= tile.width
+        elif align == "center":
+            x -= tile.width // 2
+        tile.blit(frame, x, y)
+
+    def add_navigation_lines(self, frame, motor_status, state):
+        self.navigation_layer.blend(frame)
+
+        # ODO
+        self.draw_text(frame, "odo", f"ODO: {motor_status['abs_distance'] / 1000:.2f} m", (5, 5 + self.text_height))
+
+        # Mode
+        if state is not None:
+            state = state.upper().replace("_", " ")
+            self.draw_text(frame, "state", state, (self.res_x - 5, 5 + self.text_height), align="right")
+
+        # Left
+        self.draw_text(frame, "left_rpm", f"{motor_status['left']['speed_rpm']} RPM", (5, self.res_y - 15))
+        cv2.rectangle(frame, (5, self.res_y - 50 - 200), (5 + 40, self.res_y - 50 - 200 - int(motor_status['left']['duty'] * 2)), HUD_COLOR, -1)
+
+        # Right
+        self.draw_text(
+            frame, "right_rpm", f"{motor_status['right']['speed_rpm']} RPM", (self.res_x - 5, self.res_y - 15), align="right"
+        )
+        cv2.rectangle(frame, (self.res_x - 5, self.res_y - 50 - 200), (self.res_x - 5 - 40, self.res_y - 50 - 200 - int(motor_status['right']['duty'] * 2)), HUD_COLOR, -1)
+
+    def add_radar(self, frame, us_distances):
+        self.radar_layer.blend(frame)
+
+        left_us_distance, front_us_distance, right_us_distance = us_distances
+        for distance, angle in [(left_us_distance, -45), (front_us_distance, 0), (right_us_distance, 45)]:
+            if distance is None:
+                continue
+            normalized_distance = self.radar_radius * distance / 0.5
+            if normalized_distance <= self.radar_radius:
+                cx = normalized_distance * math.sin(angle * math.pi / 180)
+                cy = normalized_distance * math.cos(angle * math.pi / 180)
+                x = int(cx + self.res_x // 2)
+                y = int(self.res_y - cy)
+                cv2.circle(frame, (x, y), radius=4, color=(0, 0, 255), thickness=2)
@@ -0,0 +1,274 @@
+import cv2
+import logging
+import numpy as np
+import queue
+import threading
+
+from video.avi import MJPEGAVIWriter
+
+logger = logging.getLogger(__name__)
+
+# Recording modes: encode re-encodes the raw frames with the configured codec, passthrough writes the JPEG frames of the
+# stream as they are in an MJPEG AVI
+RECORDING_MODE_ENCODE = "encode"
+RECORDING_MODE_PASSTHROUGH = "passthrough"
+
+
+class MediaWriter(object):
+    # Writes the recorded videos and the captured pictures on its own thread, the capture thread never waits on the
+    # disk. Video frames are copied in a pool of reused buffers, frames are dropped when all the buffers are
+    # queued. The writer thread owns the video writer and fills the missing frames from the capture timestamps.
+    queue_size = 16
+    jobs = queue.Queue()
+    free_buffers = []
+    lock = threading.Lock()
+    thread = None
+    # Writer thread state
+    video_writer = None
+    video_path = None
+    video_codec = None
+    video_mode = RECORDING_MODE_ENCODE
+    video_frame_rate = None
+    video_size = None
+    video_start_ts = None
+    video_last_ts = None
+    frame_counter = 0
+    # Pre-recorded frames, held until the video is opened with the size of the live frames
+    prerecorded_frames = []
+    # Stats
+    nb_of_queued_frames = 0
+    nb_of_written_frames = 0
+    nb_of_duplicated_frames = 0
+    nb_of_dropped_frames = 0
+    nb_of_pictures = 0
+
+    @staticmethod
+    def setup(queue_size):
+        MediaWriter.queue_size = queue_size
+
+    @staticmethod
+    def start():
+        with MediaWriter.lock:
+            if MediaWriter.thread is None:
+                MediaWriter.thread = threading.Thread(target=MediaWriter.process_jobs, daemon=True)
+                MediaWriter.thread.start()
+
+    @staticmethod
+    def stop():
+        if MediaWriter.thread is not None:
+            MediaWriter.jobs.put(None)
+            MediaWriter.thread.join()
+            MediaWriter.thread = None
+
+    @staticmethod
+    def reserve_slot():
+        # Returns False if the writer is lagging behind and the frame must be dropped
+        with MediaWriter.lock:
+            if MediaWriter.nb_of_queued_frames >= MediaWriter.queue_size:
+                MediaWriter.nb_of_dropped_frames += 1
+                return False
+            MediaWriter.nb_of_queued_frames += 1
+            return True
+
+    @staticmethod
+    def get_buffer(image):
+        # Returns a free buffer for the image, None if the writer is lagging behind
+        if not MediaWriter.reserve_slot():
+            return None
+        with MediaWriter.lock:
+            while len(MediaWriter.free_buffers) > 0:
+                buffer = MediaWriter.free_buffers.pop()
+                if buffer.shape == image.shape and buffer.dtype == image.dtype:
+                    return buffer
+        return np.empty_like(image)
+
+    @staticmethod
+    def release_slot(buffer=None):
+        with MediaWriter.lock:
+            MediaWriter.nb_of_queued_frames -= 1
+            if buffer is not None and len(MediaWriter.free_buffers) < MediaWriter.queue_size:
+                MediaWriter.free_buffers.append(buffer)
+
+    @staticmethod
+    def start_video(path, frame_rate, codec, mode=RECORDING_MODE_ENCODE):
+        MediaWriter.start()
+        MediaWriter.jobs.put(("start_video", path, frame_rate, codec, mode))
+
+    @staticmethod
+    def stop_video():
+        MediaWriter.jobs.put(("stop_video",))
+
+    @staticmethod
+    def write_video_frame(image, timestamp):
+        # Returns False if the frame was dropped
+        buffer = MediaWriter.get_buffer(image)
+        if buffer is None:
+            return False
+        np.copyto(buffer, image)
+        MediaWriter.jobs.put(("video_frame", buffer, timestamp))
+        return True
+
+    @staticmethod
+    def write_encoded_video_frame(encoded_frame, prerecorded=False):
+        # JPEG encoded frame, written as is in passthrough mode and decoded on the writer thread otherwise. Returns False
+        # if the frame was dropped, pre-recorded frames are never dropped.
+        if not prerecorded and not MediaWriter.reserve_slot():
+            return False
+        MediaWriter.jobs.put(("encoded_video_frame", encoded_frame, prerecorded))
+        return True
+
+    @staticmethod
+    def write_picture(path, image):
+        MediaWriter.start()
+        MediaWriter.jobs.put(("picture", path, image.copy()))
+
+    @staticmethod
+    def process_jobs():
+        while True:
+            job = MediaWriter.jobs.get()
+            if job is None:
+                MediaWriter.close_video()
+                break
+            try:
+                if job[0] == "start_video":
+                    MediaWriter.close_video()
+                    _, MediaWriter.video_path, MediaWriter.video_frame_rate, MediaWriter.video_codec, \
+                        MediaWriter.video_mode = job
+                elif job[0] == "stop_video":
+                    MediaWriter.close_video()
+                elif job[0] == "video_frame":
+                    _, buffer, timestamp = job
+                    try:
+                        MediaWriter.write_frame(buffer, timestamp)
+                    finally:
+                        MediaWriter.release_slot(buffer)
+                elif job[0] == "encoded_video_frame":
+                    _, encoded_frame, prerecorded = job
+                    if prerecorded:
+                        # They may be of a smaller tier than the live frames, which set the size of the video
+                        MediaWriter.prerecorded_frames.append(encoded_frame)
+                        continue
+                    try:
+                        MediaWriter.write_encoded_frame(encoded_frame)
+                    finally:
+                        MediaWriter.release_slot()
+                elif job[0] == "picture":
+                    _, path, image = job
+                    cv2.imwrite(path, image)
+                    MediaWriter.nb_of_pictures += 1
+            except Exception:
+                logger.error(f"Unable to process media job {job[0]}", exc_info=True)
+
+    @staticmethod
+    def open_video(width, height, timestamp):
+        if MediaWriter.video_mode == RECORDING_MODE_PASSTHROUGH:
+            MediaWriter.video_writer = MJPEGAVIWriter(
+                filename=MediaWriter.video_path, frame_rate=MediaWriter.video_frame_rate, width=width, height=height,
+            )
+        else:
+            MediaWriter.video_writer = cv2.VideoWriter(
+                filename=MediaWriter.video_path,
+                fourcc=cv2.VideoWriter_fourcc(*MediaWriter.video_codec),
+                fps=MediaWriter.video_frame_rate,
+                frameSize=(width, height),
+                isColor=True,
+            )
+        MediaWriter.video_size = (width, height)
+        MediaWriter.video_start_ts = timestamp
+        MediaWriter.frame_counter = 0
+        # The video starts with the pre-recorded frames, scaled to its size if needed
+        prerecorded_frames = MediaWriter.prerecorded_frames
+        MediaWriter.prerecorded_frames = []
+        if len(prerecorded_frames) > 0:
+            MediaWriter.video_start_ts = min(timestamp, prerecorded_frames[0].timestamp)
+        for encoded_frame in prerecorded_frames:
+            MediaWriter.write_encoded_frame(encoded_frame)
+
+    @staticmethod
+    def get_nb_of_copies(timestamp):
+        # Number of times the frame is written, to cover the time since the previous one and keep the video in real
+        # time. 0 if the frame must be skipped.
+        if MediaWriter.video_path is None:
+            # Late frame, the video has been stopped
+            return 0
+        if MediaWriter.video_last_ts is not None and timestamp <= MediaWriter.video_last_ts:
+            # Already covered, e.g. a pre-recorded frame overlapping the live ones
+            return 0
+        if MediaWriter.video_writer is None:
+            return 1
+        expected_nb_of_frames = int((timestamp - MediaWriter.video_start_ts) * MediaWriter.video_frame_rate) + 1
+        return max(1, expected_nb_of_frames - MediaWriter.frame_counter)
+
+    @staticmethod
+    def frame_written(timestamp, nb_of_copies):
+        MediaWriter.video_last_ts = timestamp
+        MediaWriter.frame_counter += nb_of_copies
+        MediaWriter.nb_of_written_frames += 1
+        MediaWriter.nb_of_duplicated_frames += nb_of_copies - 1
+
+    @staticmethod
+    def write_frame(image, timestamp):
+        if MediaWriter.video_writer is None and MediaWriter.video_path is not None:
+            MediaWriter.open_video(image.shape[1], image.shape[0], timestamp)
+        nb_of_copies = MediaWriter.get_nb_of_copies(timestamp)
+        if nb_of_copies == 0:
+            return
+        if (image.shape[1], image.shape[0]) != MediaWriter.video_size:
+            # The streamed camera changed, the video keeps its size
+            image = cv2.resize(image, MediaWriter.video_size, interpolation=cv2.INTER_AREA)
+        if MediaWriter.video_mode == RECORDING_MODE_PASSTHROUGH:
+            MediaWriter.video_writer.write(cv2.imencode('.jpg', image)[1].tobytes(), nb_of_copies)
+        else:
+            for _ in range(nb_of_copies):
+                MediaWriter.video_writer.write(image)
+        MediaWriter.frame_written(timestamp, nb_of_copies)
+
+    @staticmethod
+    def write_encoded_frame(encoded_frame):
+        if MediaWriter.video_writer is None and MediaWriter.video_path is not None:
+            MediaWriter.open_video(encoded_frame.width, encoded_frame.height, encoded_frame.timestamp)
+        if MediaWriter.video_mode != RECORDING_MODE_PASSTHROUGH or (
+            (encoded_frame.width, encoded_frame.height) != MediaWriter.video_size
+        ):
+            # Not the same size or not stored as JPEG, the frame needs to be decoded
+            image = cv2.imdecode(np.frombuffer(encoded_frame.data, dtype=np.uint8), cv2.IMREAD_COLOR)
+            MediaWriter.write_frame(image, encoded_frame.timestamp)
+            return
+        nb_of_copies = MediaWriter.get_nb_of_copies(encoded_frame.timestamp)
+        if nb_of_copies == 0:
+            return
+        MediaWriter.video_writer.write(encoded_frame.data, nb_of_copies)
+        MediaWriter.frame_written(encoded_frame.timestamp, nb_of_copies)
+
+    @staticmethod
+    def close_video():
+        if (
+            MediaWriter.video_writer is None
+            and MediaWriter.video_path is not None
+            and len(MediaWriter.prerecorded_frames) > 0
+        ):
+            # Stopped before any live frame, the video only has the pre-recorded ones
+            encoded_frame = MediaWriter.prerecorded_frames[0]
+            MediaWriter.open_video(encoded_frame.width, encoded_frame.height, encoded_frame.timestamp)
+        MediaWriter.prerecorded_frames = []
+        if MediaWriter.video_writer is not None:
+            MediaWriter.video_writer.release()
+            logger.info(f"Video {MediaWriter.video_path} closed, {MediaWriter.frame_counter} frames")
+        MediaWriter.video_writer = None
+        MediaWriter.video_path = None
+        MediaWriter.video_start_ts = None
+        MediaWriter.video_last_ts = None
+
+    @staticmethod
+    def serialize():
+        return {
+            'recording': MediaWriter.video_path is not None,
+            'mode': MediaWriter.video_mode,
+            'queue_depth': MediaWriter.jobs.qsize(),
+            'queued_frames': MediaWriter.nb_of_queued_frames,
+            'max_queued_frames': MediaWriter.queue_size,
+            'written_frames': MediaWriter.nb_of_written_frames,
+            'duplicated_frames': MediaWriter.nb_of_duplicated_frames,
+            'dropped_frames': MediaWriter.nb_of_dropped_frames,
+            'pictures': MediaWriter.nb_of_pictures,
+        }
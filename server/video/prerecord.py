@@ -0,0 +1,49 @@
+import collections
+import threading
+
+
+class PrerecordBuffer(object):
+    # Keeps the last seconds of encoded stream frames, so a recording can start with what happened before it was
+    # requested. Bounded by duration and by size, the oldest frames are dropped first. The frames come from the largest
+    # streamed tier, they are all of the same tier: the buffer restarts when the tier changes.
+
+    def __init__(self, seconds, max_bytes):
+        self.seconds = seconds
+        self.max_bytes = max_bytes
+        self.frames = collections.deque()
+        self.nb_of_bytes = 0
+        self.lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.seconds > 0 and self.max_bytes > 0
+
+    def add(self, encoded_frame):
+        # Called from the encoder threads
+        with self.lock:
+            if len(self.frames) > 0 and self.frames[-1].tier != encoded_frame.tier:
+                self.frames.clear()
+                self.nb_of_bytes = 0
+            self.frames.append(encoded_frame)
+            self.nb_of_bytes += len(encoded_frame.data)
+            while len(self.frames) > 0 and (
+                self.nb_of_bytes > self.max_bytes
+                or encoded_frame.timestamp - self.frames[0].timestamp > self.seconds
+            ):
+                self.nb_of_bytes -= len(self.frames.popleft().data)
+
+    def flush(self):
+        # Returns the buffered frames, oldest first, and empties the buffer
+        with self.lock:
+            frames = list(self.frames)
+            self.frames.clear()
+            self.nb_of_bytes = 0
+        return frames
+
+    def serialize(self):
+        return {
+            'seconds': self.seconds,
+            'max_bytes': self.max_bytes,
+            'frames': len(self.frames),
+            'bytes': self.nb_of_bytes,
+        }
@@ -0,0 +1,70 @@
+import cv2
+import time
+
+# Scale of the images compared by the detector
+SCENE_SCALE = 8
+
+
+def get_scene_image(frame):
+    # Gray image of the frame at 1/8 of its resolution. JPEG frames not decoded yet are decoded at this scale only,
+    # which is a lot cheaper than a full decode.
+    if not frame.is_decoded:
+        return cv2.imdecode(frame.jpeg, cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    image = frame.get_image(scale=4, gray=True)
+    # Rounded up, as the JPEG decoder does
+    return cv2.resize(image, ((image.shape[1] + 1) // 2, (image.shape[0] + 1) // 2), interpolation=cv2.INTER_AREA)
+
+
+class SceneChangeDetector(object):
+    # Detects when the streamed scene is static, for the camera to skip encoding and sending the frames. A frame is
+    # sent if enough pixels changed since the last sent frame, if its telemetry changed, or if the last frame was sent
+    # more than keyframe_interval seconds ago so that the clients know the stream is alive.
+    CHANGED_PIXELS_RATIO = 0.002
+
+    def __init__(self, threshold, keyframe_interval):
+        self.threshold = threshold  # in gray levels, 0 to disable the detection
+        self.keyframe_interval = keyframe_interval
+        self.last_images = None
+        self.last_telemetry = None
+        self.last_sent_ts = 0
+        self.nb_of_sent_frames = 0
+        self.nb_of_suppressed_frames = 0
+
+    @property
+    def enabled(self):
+        return self.threshold > 0
+
+    def has_changed(self, frames, telemetry):
+        # frames: the frames composing the streamed image, e.g. the streamed frame and its overlay
+        now = time.monotonic()
+        images = [get_scene_image(frame) for frame in frames]
+        changed = (
+            now - self.last_sent_ts > self.keyframe_interval
+            or telemetry != self.last_telemetry
+            or self.last_images is None
+            or len(images) != len(self.last_images)
+            or any(self.image_has_changed(image, last_image) for image, last_image in zip(images, self.last_images))
+        )
+        if changed:
+            self.last_images = images
+            self.last_telemetry = telemetry
+            self.last_sent_ts = now
+            self.nb_of_sent_frames += 1
+        else:
+            self.nb_of_suppressed_frames += 1
+        return changed
+
+    def image_has_changed(self, image, last_image):
+        if image is None or last_image is None or image.shape != last_image.shape:
+            return True
+        diff = cv2.absdiff(image, last_image)
+        nb_of_changed_pixels = cv2.countNonZero(cv2.threshold(diff, self.threshold, 255, cv2.THRESH_BINARY)[1])
+        return nb_of_changed_pixels > SceneChangeDetector.CHANGED_PIXELS_RATIO * image.size
+
+    def serialize(self):
+        return {
+            'threshold': self.threshold,
+            'keyframe_interval': self.keyframe_interval,
+            'sent_frames': self.nb_of_sent_frames,
+            'suppressed_frames': self.nb_of_suppressed_frames,
+        }
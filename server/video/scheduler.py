@@ -0,0 +1,57 @@
+import collections
+import statistics
+import time
+
+
+class CaptureScheduler(object):
+    # Paces the capture at the target frame rate, sleeping until the next frame deadline instead of spinning on grab()
+    STATS_WINDOW = 50
+
+    def __init__(self, frame_rate):
+        self.frame_rate = frame_rate
+        self.next_deadline = None
+        self.last_frame_ts = None
+        self.intervals = collections.deque(maxlen=CaptureScheduler.STATS_WINDOW)
+
+    @property
+    def frame_delay(self):
+        return 1.0 / max(1, self.frame_rate)
+
+    def wait_next_frame(self):
+        now = time.monotonic()
+        if self.next_deadline is None:
+            self.next_deadline = now
+        delay = self.next_deadline - now
+        if delay > 0:
+            time.sleep(delay)
+            now = time.monotonic()
+        # Too late by more than a frame (e.g. slow consumer), restart from now instead of capturing a burst of frames
+        if now - self.next_deadline > self.frame_delay:
+            self.next_deadline = now
+        self.next_deadline += self.frame_delay
+
+    def frame_captured(self):
+        now = time.monotonic()
+        if self.last_frame_ts is not None:
+            self.intervals.append(now - self.last_frame_ts)
+        self.last_frame_ts = now
+
+    @property
+    def fps(self):
+        if len(self.intervals) == 0:
+            return 0.0
+        return len(self.intervals) / sum(self.intervals)
+
+    @property
+    def jitter(self):
+        # Standard deviation of the interval between frames, in seconds
+        if len(self.intervals) < 2:
+            return 0.0
+        return statistics.pstdev(self.intervals)
+
+    def serialize(self):
+        return {
+            'target_fps': self.frame_rate,
+            'fps': round(self.fps, 2),
+            'jitter_ms': round(self.jitter * 1000, 2),
+        }
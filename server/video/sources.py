@@ -0,0 +1,79 @@
+import cv2
+import logging
+import numpy as np
+import os
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+JPEG_EXTENSIONS = (".jpg", ".jpeg")
+
+
+class ReplaySource(object):
+    # Capture device replaying a video file or a directory of images in a loop. JPEG images are returned as they are,
+    # like the frames of a native MJPEG camera.
+
+    def __init__(self, path):
+        self.path = path
+        self.video = None
+        self.images = []
+        self.index = 0
+        if os.path.isdir(path):
+            self.images = sorted(
+                os.path.join(path, filename) for filename in os.listdir(path)
+                if filename.lower().endswith(IMAGE_EXTENSIONS)
+            )
+            if len(self.images) == 0:
+                raise ValueError(f"No image to replay in {path}")
+        else:
+            self.video = cv2.VideoCapture(path)
+            if not self.video.isOpened():
+                raise ValueError(f"Unable to open video {path}")
+
+    def read(self, buffer):
+        # Returns the next image, or the JPEG data as a 1-D array
+        if self.video is not None:
+            ret, image = self.video.read(buffer if buffer.size > 0 else None)
+            if not ret:
+                # Replay from the beginning
+                self.video.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                ret, image = self.video.read()
+            return image if ret else None
+        filename = self.images[self.index]
+        self.index = (self.index + 1) % len(self.images)
+        if filename.lower().endswith(JPEG_EXTENSIONS):
+            return np.fromfile(filename, dtype=np.uint8)
+        return cv2.imread(filename, cv2.IMREAD_COLOR)
+
+    def release(self):
+        if self.video is not None:
+            self.video.release()
+
+
+class SyntheticSource(object):
+    # Capture device generating frames: a textured background with a few moving shapes, so that the frames compress
+    # and change like a real scene
+
+    def __init__(self, res_x, res_y):
+        self.res_x = res_x
+        self.res_y = res_y
+        self.frame_counter = 0
+        noise = np.random.default_rng(0).integers(0, 256, (res_y // 8, res_x // 8, 3), dtype=np.uint8)
+        self.background = cv2.resize(noise, (res_x, res_y), interpolation=cv2.INTER_CUBIC)
+
+    def read(self, buffer):
+        self.frame_counter += 1
+        if buffer.shape != self.background.shape:
+            buffer = np.empty_like(self.background)
+        np.copyto(buffer, self.background)
+        t = self.frame_counter
+        # Ball bouncing horizontally, square moving vertically
+        x = abs((t * 8) % (2 * self.res_x) - self.res_x)
+        y = abs((t * 4) % (2 * self.res_y) - self.res_y)
+        cv2.circle(buffer, (x, self.res_y // 2), self.res_y // 10, (0, 0, 255), -1)
+        cv2.rectangle(buffer, (self.res_x // 4, y), (self.res_x // 4 + self.res_y // 8, y + self.res_y // 8), (255, 0, 0), -1)
+        cv2.putText(buffer, f"{self.frame_counter}", (10, self.res_y - 10), cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
+        return buffer
+
+    def release(self):
+        pass
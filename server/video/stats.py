@@ -0,0 +1,78 @@
+import bisect
+import collections
+import contextlib
+import threading
+import time
+
+# Upper bounds of the histogram buckets, in ms
+HISTOGRAM_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000)
+
+
+class StageStats(object):
+    __slots__ = ("count", "total", "max", "samples", "histogram")
+
+    def __init__(self, max_samples):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples = collections.deque(maxlen=max_samples)
+        self.histogram = [0] * (len(HISTOGRAM_BUCKETS) + 1)
+
+    def record(self, duration):
+        self.count += 1
+        self.total += duration
+        self.max = max(self.max, duration)
+        self.samples.append(duration)
+        self.histogram[bisect.bisect_left(HISTOGRAM_BUCKETS, 1000 * duration)] += 1
+
+    def serialize(self):
+        samples = sorted(self.samples)
+        histogram = {f"<={bucket}": count for bucket, count in zip(HISTOGRAM_BUCKETS, self.histogram)}
+        histogram[f">{HISTOGRAM_BUCKETS[-1]}"] = self.histogram[-1]
+        return {
+            'count': self.count,
+            'mean_ms': round(1000 * self.total / self.count, 3) if self.count > 0 else None,
+            'p50_ms': round(1000 * samples[len(samples) // 2], 3) if len(samples) > 0 else None,
+            'p95_ms': round(1000 * samples[int(len(samples) * 0.95)], 3) if len(samples) > 0 else None,
+            'max_ms': round(1000 * self.max, 3),
+            'histogram_ms': histogram,
+        }
+
+
+class StatsCollector(object):
+    # Durations recorded by stage name, percentiles are computed on the last samples of each stage
+    MAX_SAMPLES = 1000
+
+    def __init__(self):
+        self.stages = {}
+        self.lock = threading.Lock()
+
+    def record(self, stage, duration):
+        with self.lock:
+            stage_stats = self.stages.get(stage)
+            if stage_stats is None:
+                stage_stats = StageStats(StatsCollector.MAX_SAMPLES)
+                self.stages[stage] = stage_stats
+            stage_stats.record(duration)
+
+    @contextlib.contextmanager
+    def measure(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def reset(self):
+        with self.lock:
+            self.stages = {}
+
+    def serialize(self):
+        with self.lock:
+            return {stage: stage_stats.serialize() for stage, stage_stats in self.stages.items()}
+
+
+# Time spent in each stage of the camera pipeline: grab, retrieve, annotate, handlers, hud, encode, fanout...
+pipeline_stats = StatsCollector()
+# Age of the streamed frames when they reach each stage, from their capture to their display by the client
+latency_stats = StatsCollector()
@@ -0,0 +1,50 @@
+import cv2
+
+
+class TemplateTracker(object):
+    # Follows a detected object between two detections, by matching its template in a small window around its last
+    # position. Boxes are (x, y, w, h) in the coordinates of the tracked image.
+    SEARCH_MARGIN = 0.5  # Search window margin, relative to the object size
+
+    def __init__(self, min_confidence=0.6):
+        self.min_confidence = min_confidence
+        self.template = None
+        self.box = None
+        self.confidence = 0.0
+
+    @property
+    def tracking(self):
+        return self.template is not None
+
+    def init(self, image, box):
+        x, y, w, h = box
+        if w < 4 or h < 4:
+            self.reset()
+            return
+        self.template = image[y:y + h, x:x + w].copy()
+        self.box = (x, y, w, h)
+        self.confidence = 1.0
+
+    def reset(self):
+        self.template = None
+        self.box = None
+        self.confidence = 0.0
+
+    def update(self, image):
+        # Returns the new box, or None if the object is lost
+        if not self.tracking:
+            return None
+        x, y, w, h = self.box
+        margin_x, margin_y = int(w * TemplateTracker.SEARCH_MARGIN), int(h * TemplateTracker.SEARCH_MARGIN)
+        left, top = max(0, x - margin_x), max(0, y - margin_y)
+        right, bottom = min(image.shape[1], x + w + margin_x), min(image.shape[0], y + h + margin_y)
+        if right - left < w or bottom - top < h:
+            self.reset()
+            return None
+        scores = cv2.matchTemplate(image[top:bottom, left:right], self.template, cv2.TM_CCOEFF_NORMED)
+        _, self.confidence, _, (match_x, match_y) = cv2.minMaxLoc(scores)
+        if self.confidence < self.min_confidence:
+            self.reset()
+            return None
+        self.box = (left + match_x, top + match_y, w, h)
+        return self.box
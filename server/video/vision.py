@@ -0,0 +1,225 @@
+import atexit
+import contextlib
+import itertools
+import logging
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+import queue
+import sys
+import threading
+import traceback
+
+from video.vision_tasks import VISION_TASKS
+
+logger = logging.getLogger(__name__)
+
+
+def worker_main(task_queue, result_queue):
+    # Entry point of the worker processes. Images are read from the shared memory blocks, only the job description and
+    # the results are pickled.
+    attached_blocks = {}
+    while True:
+        job = task_queue.get()
+        if job is None:
+            break
+        job_id, task, block_name, shape, dtype, kwargs = job
+        try:
+            block = attached_blocks.get(block_name)
+            if block is None:
+                block = shared_memory.SharedMemory(name=block_name)
+                attached_blocks[block_name] = block
+            image = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+            result_queue.put((job_id, VISION_TASKS[task](image, **kwargs), None))
+        except Exception:
+            result_queue.put((job_id, None, traceback.format_exc()))
+    for block in attached_blocks.values():
+        block.close()
+
+
+@contextlib.contextmanager
+def hidden_main_module():
+    # The processes started by the forkserver import the main module of the parent, i.e. the whole robot server with
+    # pygame and the hardware modules, unless it has no spec and no file when they are started
+    main_module = sys.modules["__main__"]
+    attributes = {name: main_module.__dict__[name] for name in ("__spec__", "__file__") if name in main_module.__dict__}
+    main_module.__spec__ = None
+    main_module.__dict__.pop("__file__", None)
+    try:
+        yield
+    finally:
+        main_module.__dict__.update(attributes)
+
+
+class SharedFrameSlot(object):
+    # Shared memory block holding the image of one job in flight, grown when a bigger image is submitted
+
+    def __init__(self):
+        self.block = None
+
+    def write(self, image):
+        if self.block is None or self.block.size < image.nbytes:
+            self.close()
+            self.block = shared_memory.SharedMemory(create=True, size=image.nbytes)
+        np.ndarray(image.shape, dtype=image.dtype, buffer=self.block.buf)[...] = image
+        return self.block.name
+
+    def close(self):
+        if self.block is not None:
+            self.block.close()
+            self.block.unlink()
+            self.block = None
+
+
+class VisionExecutor(object):
+    # Runs the vision tasks in worker processes, out of the capture thread and of the GIL. Results are delivered to the
+    # callbacks on the result thread, None if the task failed. With 0 worker, tasks run synchronously in the calling
+    # thread.
+    nb_of_workers = 2
+    # in s, how often the result thread checks that the workers are alive
+    LIVENESS_INTERVAL = 1.0
+    workers = []
+    task_queue = None
+    result_queue = None
+    result_thread = None
+    free_slots = []
+    pending_jobs = {}
+    lock = threading.Lock()
+    job_counter = itertools.count()
+
+    @staticmethod
+    def setup(workers):
+        VisionExecutor.nb_of_workers = workers
+
+    @staticmethod
+    def start():
+        with VisionExecutor.lock:
+            if len(VisionExecutor.workers) > 0:
+                return
+            logger.info(f"Starting {VisionExecutor.nb_of_workers} vision workers")
+            VisionExecutor.start_workers()
+            VisionExecutor.result_thread = threading.Thread(target=VisionExecutor.process_results, daemon=True)
+            VisionExecutor.result_thread.start()
+            atexit.register(VisionExecutor.stop)
+
+    @staticmethod
+    def start_workers():
+        # Called with the lock held. Workers are forked from a clean server process which only imports the vision
+        # tasks, instead of forking the multithreaded robot server, and they don't import the main module
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload(["video.vision_tasks"])
+        VisionExecutor.task_queue = context.Queue()
+        VisionExecutor.result_queue = context.Queue()
+        # Two jobs in flight per worker: one running, one queued
+        VisionExecutor.free_slots = [SharedFrameSlot() for _ in range(2 * VisionExecutor.nb_of_workers)]
+        with hidden_main_module():
+            for _ in range(VisionExecutor.nb_of_workers):
+                worker = context.Process(
+                    target=worker_main, args=(VisionExecutor.task_queue, VisionExecutor.result_queue), daemon=True
+                )
+                worker.start()
+                VisionExecutor.workers.append(worker)
+
+    @staticmethod
+    def stop_workers():
+        # Called with the lock held. Returns the callbacks of the jobs which will never complete
+        for worker in VisionExecutor.workers:
+            worker.terminate()
+        for worker in VisionExecutor.workers:
+            worker.join(timeout=1)
+        VisionExecutor.workers = []
+        for slot in VisionExecutor.free_slots:
+            slot.close()
+        callbacks = []
+        for slot, callback in VisionExecutor.pending_jobs.values():
+            slot.close()
+            callbacks.append(callback)
+        VisionExecutor.free_slots = []
+        VisionExecutor.pending_jobs = {}
+        return callbacks
+
+    @staticmethod
+    def stop():
+        with VisionExecutor.lock:
+            for _ in VisionExecutor.workers:
+                VisionExecutor.task_queue.put(None)
+            for worker in VisionExecutor.workers:
+                worker.join(timeout=1)
+            VisionExecutor.stop_workers()
+            if VisionExecutor.result_queue is not None:
+                VisionExecutor.result_queue.put(None)
+
+    @staticmethod
+    def restart_dead_workers():
+        # A worker killed by a crash or by the OOM killer never returns its job, and may leave the queues in a broken
+        # state: restart all the workers with new queues and fail the outstanding jobs so that their callbacks run.
+        with VisionExecutor.lock:
+            dead_workers = [worker for worker in VisionExecutor.workers if not worker.is_alive()]
+            if len(dead_workers) == 0:
+                return
+            for worker in dead_workers:
+                logger.error(
+                    f"Vision worker {worker.pid} died with exit code {worker.exitcode}, restarting the workers"
+                )
+            callbacks = VisionExecutor.stop_workers()
+            for old_queue in (VisionExecutor.task_queue, VisionExecutor.result_queue):
+                old_queue.cancel_join_thread()
+                old_queue.close()
+            VisionExecutor.start_workers()
+        for callback in callbacks:
+            VisionExecutor.run_callback(callback, None)
+
+    @staticmethod
+    def submit(task, image, callback, **kwargs):
+        # Returns False if the job was dropped because all the workers are busy
+        if VisionExecutor.nb_of_workers <= 0:
+            callback(VISION_TASKS[task](image, **kwargs))
+            return True
+        if len(VisionExecutor.workers) == 0:
+            VisionExecutor.start()
+        with VisionExecutor.lock:
+            if len(VisionExecutor.free_slots) == 0:
+                return False
+            slot = VisionExecutor.free_slots.pop()
+            job_id = next(VisionExecutor.job_counter)
+            VisionExecutor.pending_jobs[job_id] = (slot, callback)
+            # Written with the lock held, so that a restart of the workers can't close the slot in between
+            block_name = slot.write(image)
+            VisionExecutor.task_queue.put((job_id, task, block_name, image.shape, image.dtype.str, kwargs))
+        return True
+
+    @staticmethod
+    def run_callback(callback, result):
+        # Callbacks get None if the task failed
+        try:
+            callback(result)
+        except Exception:
+            logger.error("Unexpected exception in vision callback", exc_info=True)
+
+    @staticmethod
+    def process_results():
+        while True:
+            result_queue = VisionExecutor.result_queue
+            try:
+                result = result_queue.get(timeout=VisionExecutor.LIVENESS_INTERVAL)
+            except queue.Empty:
+                VisionExecutor.restart_dead_workers()
+                continue
+            except (EOFError, OSError):
+                # Queue closed at shutdown
+                break
+            if result is None:
+                break
+            job_id, result, error = result
+            with VisionExecutor.lock:
+                if result_queue is not VisionExecutor.result_queue:
+                    # Late result of a worker stopped by a restart, its job already failed
+                    continue
+                slot, callback = VisionExecutor.pending_jobs.pop(job_id, (None, None))
+                if slot is not None:
+                    VisionExecutor.free_slots.append(slot)
+            if error is not None:
+                logger.error(f"Vision task failed: {error}")
+            if callback is not None:
+                VisionExecutor.run_callback(callback, result)
+            VisionExecutor.restart_dead_workers()
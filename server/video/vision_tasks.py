@@ -0,0 +1,58 @@
+import cv2
+
+# Vision tasks run by the VisionExecutor, in the worker processes. This module must stay light: workers only import it
+# and its dependencies.
+VISION_TASKS = {}
+
+# Eyes are about a quarter of the face width, they can't be found in faces too small for the window of the eye cascade
+EYE_CASCADE_SIZE = 20
+MIN_EYE_PASS_FACE_SIZE = 4 * EYE_CASCADE_SIZE
+
+_cascades = {}
+_qr_code_detector = None
+
+
+def vision_task(name):
+
+    def wrapper(function):
+        VISION_TASKS[name] = function
+        return function
+    return wrapper
+
+
+def get_cascade(name):
+    # Cascades are loaded once per process
+    cascade = _cascades.get(name)
+    if cascade is None:
+        cascade = cv2.CascadeClassifier(cv2.data.haarcascades + name)
+        _cascades[name] = cascade
+    return cascade
+
+
+@vision_task("detect_faces")
+def detect_faces(gray, scale, min_size, max_size):
+    # Look for faces and for their eyes in the image downscaled by scale, sizes are in full resolution.
+    # Returns a list of (x, y, w, h, nb_of_eyes) in full resolution coordinates, nb_of_eyes is None if the face is too
+    # small for the eye pass
+    faces = get_cascade('haarcascade_frontalface_default.xml').detectMultiScale(
+        gray, 1.1, 4, minSize=(min_size // scale, min_size // scale), maxSize=(max_size // scale, max_size // scale)
+    )
+    results = []
+    for x, y, w, h in faces:
+        nb_of_eyes = None
+        if w >= MIN_EYE_PASS_FACE_SIZE:
+            nb_of_eyes = len(get_cascade('haarcascade_eye.xml').detectMultiScale(gray[y:y + h, x:x + w]))
+        results.append((int(x * scale), int(y * scale), int(w * scale), int(h * scale), nb_of_eyes))
+    return results
+
+
+@vision_task("decode_qr_codes")
+def decode_qr_codes(image):
+    # Returns a list of (data, corners) for each decoded QR code, corners in image coordinates
+    global _qr_code_detector
+    if _qr_code_detector is None:
+        _qr_code_detector = cv2.QRCodeDetector()
+    found, decoded_info, points, _ = _qr_code_detector.detectAndDecodeMulti(image)
+    if not found or points is None:
+        return []
+    return [(data, corners.tolist()) for data, corners in zip(decoded_info, points) if data]
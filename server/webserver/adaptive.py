@@ -0,0 +1,97 @@
+import logging
+import statistics
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class AdaptiveStreamController(object):
+    # Moves a video session between quality levels from the backpressure of its client: how long the client takes to
+    # acknowledge the frames, and how many frames are dropped while waiting for it. The levels go from the best
+    # encoding tier at the capture frame rate down to the lowest tier, then to the lowest tier with the FPS_CAPS.
+    FPS_CAPS = (10, 5, 2)
+    WINDOW = 2.0  # in s, time between two decisions
+    DEGRADE_ACK_DELAY = 0.25  # in s
+    UPGRADE_ACK_DELAY = 0.1  # in s
+    DEGRADE_DROP_RATIO = 0.5
+    UPGRADE_DROP_RATIO = 0.1
+    # Good windows in a row before upgrading, so that a client on the edge doesn't oscillate between two levels
+    UPGRADE_WINDOWS = 3
+
+    def __init__(self, tiers):
+        tiers = sorted(tiers, key=lambda tier: (tier.scale, tier.quality), reverse=True)
+        self.levels = [(tier.name, None) for tier in tiers]
+        self.levels += [(tiers[-1].name, max_fps) for max_fps in AdaptiveStreamController.FPS_CAPS]
+        self.level = 0
+        self.window_start = time.monotonic()
+        self.ack_delays = []
+        self.nb_of_sent_frames = 0
+        self.nb_of_dropped_frames = 0
+        self.nb_of_good_windows = 0
+        self.nb_of_changes = 0
+
+    @property
+    def tier(self):
+        return self.levels[self.level][0]
+
+    @property
+    def max_fps(self):
+        return self.levels[self.level][1]
+
+    def frame_sent(self):
+        self.nb_of_sent_frames += 1
+
+    def frames_dropped(self, nb_of_frames):
+        # Frames replaced in the slot of the session while it was waiting for the client
+        self.nb_of_dropped_frames += nb_of_frames
+
+    def frame_acknowledged(self, delay):
+        self.ack_delays.append(delay)
+
+    def update(self):
+        # Returns True when the level changed
+        now = time.monotonic()
+        if now - self.window_start < AdaptiveStreamController.WINDOW:
+            return False
+        ack_delay = statistics.median(self.ack_delays) if len(self.ack_delays) > 0 else None
+        nb_of_frames = self.nb_of_sent_frames + self.nb_of_dropped_frames
+        drop_ratio = self.nb_of_dropped_frames / nb_of_frames if nb_of_frames > 0 else 0
+        self.window_start = now
+        self.ack_delays = []
+        self.nb_of_sent_frames = 0
+        self.nb_of_dropped_frames = 0
+
+        level = self.level
+        if (
+            (ack_delay is not None and ack_delay > AdaptiveStreamController.DEGRADE_ACK_DELAY)
+            or drop_ratio > AdaptiveStreamController.DEGRADE_DROP_RATIO
+        ):
+            self.nb_of_good_windows = 0
+            level = min(self.level + 1, len(self.levels) - 1)
+        elif (
+            ack_delay is not None and ack_delay < AdaptiveStreamController.UPGRADE_ACK_DELAY
+            and drop_ratio < AdaptiveStreamController.UPGRADE_DROP_RATIO
+        ):
+            self.nb_of_good_windows += 1
+            if self.nb_of_good_windows >= AdaptiveStreamController.UPGRADE_WINDOWS:
+                self.nb_of_good_windows = 0
+                level = max(self.level - 1, 0)
+        else:
+            self.nb_of_good_windows = 0
+        if level == self.level:
+            return False
+        logger.info(
+            f"Stream level {self.levels[self.level]} -> {self.levels[level]} "
+            f"(ack delay: {ack_delay}, drop ratio: {drop_ratio:.2f})"
+        )
+        self.level = level
+        self.nb_of_changes += 1
+        return True
+
+    def serialize(self):
+        return {
+            'tier': self.tier,
+            'max_fps': self.max_fps,
+            'level': self.level,
+            'changes': self.nb_of_changes,
+        }
@@ -1,11 +1,18 @@
-from aiohttp import web
+from aiohttp import WSMsgType, web
 import asyncio
 from dataclasses import dataclass
 import logging
 import os
+import time
 import uuid
 
+from camera import Camera
 from models import Config
+from video.encoder import DEFAULT_TIER
+from video.stats import latency_stats, pipeline_stats
+from video.media_writer import MediaWriter
+from webserver.binary_protocol import encode_message
+from webserver.broadcaster import FrameBroadcaster
 from webserver.session_manager import RobotSessionManager, VideoSessionManager
 
 logger = logging.getLogger(__name__)
@@ -19,11 +26,18 @@ if not os.path.isdir(STATIC_DIR_PATH):
 INDEX_FILE_PATH = os.path.join(ROOT_DIR_PATH, "react/pirobot/build/index.html")
 if not os.path.isfile(INDEX_FILE_PATH):
     INDEX_FILE_PATH = "/var/www/index.html"
+MJPEG_BOUNDARY = "frame"
+# A snapshot is taken from the latest encoded frame if it is recent enough, from the next one otherwise
+SNAPSHOT_MAX_AGE = 2.0
+SNAPSHOT_TIMEOUT = 5.0
+# Capture started for a snapshot is kept running for the next ones, then stopped if nobody is streaming
+SNAPSHOT_IDLE_TIMEOUT = 10.0
 
 
 @dataclass
 class Context:
     robot_server = None
+    last_snapshot_ts = 0
 
 
 context = Context()
@@ -34,16 +48,23 @@ class WebSocketProtocol(object):
     def __init__(self, ws: web.WebSocketResponse):
         super().__init__()
         self.ws: web.WebSocketResponse = ws
+        # Negotiated by the client, frequent messages are then sent in binary
+        self.binary = False
 
     async def send_message(self, topic, message):
-        await self.ws.send_json(dict(topic=topic, message=message))
+        data = encode_message(topic, message) if self.binary else None
+        if data is not None:
+            await self.ws.send_bytes(data)
+        else:
+            await self.ws.send_json(dict(topic=topic, message=message))
 
     async def connection_made(self):
+        context.robot_server.connection_made(self)
         # Send robot status
         await context.robot_server.send_status(self)
 
     async def connection_lost(self):
-        context.robot_server.connection_lost()
+        context.robot_server.connection_lost(self)
 
 
 @routes.get("/")
@@ -57,6 +78,123 @@ async def get_video(path):
     return send_from_directory(os.path.join(os.environ["HOME"], "Videos"), path)
 
 
+@routes.get("/stats/video")
+async def video_stats(request):
+    return web.json_response(
+        dict(
+            capture=Camera.scheduler.serialize() if Camera.scheduler is not None else None,
+            encoder=Camera.encoder.serialize(),
+            scene=Camera.scene_detector.serialize(),
+            consumers=FrameBroadcaster.serialize(),
+            media_writer=MediaWriter.serialize(),
+            stages=pipeline_stats.serialize(),
+            latency=latency_stats.serialize(),
+        )
+    )
+
+
+@routes.get("/stream/mjpeg")
+async def mjpeg_stream(request):
+    # Video stream for the clients without websocket: recorders, VLC, dashboards... e.g. /stream/mjpeg?tier=low&fps=5
+    # Each connection gets the latest frame of its tier, the frames encoded while it is sending are dropped.
+    tier = request.query.get("tier", DEFAULT_TIER)
+    # The tiers of the regions of interest belong to the video sessions, they can be removed at any time
+    if tier not in [configured_tier.name for configured_tier in Camera.encoder.get_configured_tiers()]:
+        raise web.HTTPBadRequest(text=f"Unknown tier {tier}")
+    try:
+        max_fps = float(request.query["fps"]) if "fps" in request.query else None
+    except ValueError:
+        raise web.HTTPBadRequest(text="Invalid fps")
+    if max_fps is not None and max_fps <= 0:
+        raise web.HTTPBadRequest(text="Invalid fps")
+
+    response = web.StreamResponse(
+        headers={
+            "Content-Type": f"multipart/x-mixed-replace; boundary={MJPEG_BOUNDARY}",
+            "Cache-Control": "no-cache, no-store, must-revalidate",
+            "Pragma": "no-cache",
+        }
+    )
+    await response.prepare(request)
+    name = f"mjpeg_{uuid.uuid4()}"
+    slot = FrameBroadcaster.subscribe(name, tier)
+    Camera.start_streaming()
+    logger.info(f"New MJPEG stream [{name}], tier: {tier}, fps: {max_fps}")
+    try:
+        while True:
+            await slot.wait()
+            encoded_frame = slot.take()
+            if encoded_frame is None:
+                continue
+            last_frame_ts = time.time()
+            await response.write(
+                (
+                    f"--{MJPEG_BOUNDARY}\r\n"
+                    f"Content-Type: image/jpeg\r\n"
+                    f"Content-Length: {len(encoded_frame.data)}\r\n"
+                    f"X-Sequence: {encoded_frame.sequence}\r\n"
+                    f"X-Timestamp: {encoded_frame.timestamp:.6f}\r\n\r\n"
+                ).encode()
+            )
+            await response.write(encoded_frame.data)
+            await response.write(b"\r\n")
+            slot.nb_of_sent_frames += 1
+            if max_fps is not None:
+                await asyncio.sleep(max(0.0, last_frame_ts + 1 / max_fps - time.time()))
+    except ConnectionResetError:
+        pass
+    finally:
+        FrameBroadcaster.unsubscribe(name)
+        logger.info(f"MJPEG stream closed [{name}]")
+    return response
+
+
+def stop_snapshot_capture():
+    idle_time = time.time() - context.last_snapshot_ts
+    if idle_time < SNAPSHOT_IDLE_TIMEOUT:
+        asyncio.get_running_loop().call_later(SNAPSHOT_IDLE_TIMEOUT - idle_time, stop_snapshot_capture)
+    else:
+        Camera.stop_continuous_capture()
+
+
+@routes.get("/snapshot.jpg")
+async def snapshot(request):
+    # Latest frame of the stream, for the monitoring scripts: /snapshot.jpg?tier=low
+    # The frame sequence is used as ETag, clients revalidating with If-None-Match get a 304 until a new frame is encoded
+    tier = request.query.get("tier", DEFAULT_TIER)
+    if tier not in [configured_tier.name for configured_tier in Camera.encoder.get_configured_tiers()]:
+        raise web.HTTPBadRequest(text=f"Unknown tier {tier}")
+    context.last_snapshot_ts = time.time()
+    encoded_frame = Camera.encoder.get_latest(tier)
+    if not Camera.capturing or encoded_frame is None or time.time() - encoded_frame.timestamp > SNAPSHOT_MAX_AGE:
+        if not Camera.capturing:
+            # Nobody is streaming, capture on demand
+            Camera.start_continuous_capture()
+            asyncio.get_running_loop().call_later(SNAPSHOT_IDLE_TIMEOUT, stop_snapshot_capture)
+        encoded_frame = await FrameBroadcaster.next_frame(tier, timeout=SNAPSHOT_TIMEOUT)
+        if encoded_frame is None:
+            raise web.HTTPServiceUnavailable(text="No frame captured")
+
+    etag = f"{encoded_frame.sequence}-{encoded_frame.tier}"
+    headers = {
+        "Cache-Control": "no-cache",
+        "X-Sequence": str(encoded_frame.sequence),
+        "X-Timestamp": f"{encoded_frame.timestamp:.6f}",
+    }
+    if request.if_none_match is not None and any(match.value in (etag, "*") for match in request.if_none_match):
+        response = web.Response(status=304, headers=headers)
+    elif (
+        request.if_none_match is None and request.if_modified_since is not None
+        and int(encoded_frame.timestamp) <= request.if_modified_since.timestamp()
+    ):
+        response = web.Response(status=304, headers=headers)
+    else:
+        response = web.Response(body=encoded_frame.data, content_type="image/jpeg", headers=headers)
+    response.etag = etag
+    response.last_modified = encoded_frame.timestamp
+    return response
+
+
 @routes.get("/ws/robot")
 async def handle_message(request):
     ws = web.WebSocketResponse()
@@ -88,11 +226,14 @@ async def video_stream(request):
     session = VideoSessionManager(sid=sid, ws=ws)
     logger.info(f"New connection to video socket [{sid}]")
 
-    async for msg in ws:
-        await session.process_message(msg.data)
-
-    session.close()
-    logger.info(f"Connection closed to video socket [{sid}]")
+    try:
+        async for msg in ws:
+            if msg.type == WSMsgType.TEXT:
+                await session.process_message(msg.data)
+    finally:
+        session.close()
+        logger.info(f"Connection closed to video socket [{sid}]")
+    return ws
 
 app = web.Application()
 app.add_routes(routes)
@@ -107,4 +248,5 @@ app.add_routes(
 
 async def run_webserver(server):
     context.robot_server = server
+    FrameBroadcaster.setup(asyncio.get_running_loop())
     await web._run_app(app, port=Config.get_webserver_port())
@@ -0,0 +1,83 @@
+import math
+import struct
+
+# Compact encoding of the frequent messages of the robot websocket, e.g. the drive commands of a joystick sent at 20 to
+# 50Hz. Each binary message starts with its id, followed by a fixed layout, little endian. The other messages stay in
+# JSON. Clients opt in with {"topic": "protocol", "message": {"binary": true}}.
+PROTOCOL_VERSION = 1
+
+# Client -> server
+DRIVE_MOVE = 0x01
+DRIVE_STOP = 0x02
+CAMERA_SET_POSITION = 0x03
+# Server -> client
+CAMERA_STATUS = 0x81
+
+# id, left orientation ('F' or 'B'), left speed, right orientation, right speed, duration, distance, rotation, auto stop
+# None is sent as NO_DURATION for the duration, NaN for the distance and the rotation
+DRIVE_MOVE_LAYOUT = struct.Struct("<BcBcBHff?")
+NO_DURATION = 0xFFFF
+DRIVE_STOP_LAYOUT = struct.Struct("<B")
+# id, position
+CAMERA_SET_POSITION_LAYOUT = struct.Struct("<BB")
+# id, status, streaming, overlay, selected camera ('f' or 'b'), position, center position
+CAMERA_STATUS_LAYOUT = struct.Struct("<B2s??cBB")
+
+
+class BinaryProtocolError(ValueError):
+    pass
+
+
+def optional_float(value):
+    return None if math.isnan(value) else value
+
+
+def decode_message(data):
+    # Binary message from the client to the robot message it stands for
+    if len(data) == 0:
+        raise BinaryProtocolError("Empty message")
+    message_id = data[0]
+    try:
+        if message_id == DRIVE_MOVE:
+            (
+                _, left_orientation, left_speed, right_orientation, right_speed, duration, distance, rotation, auto_stop
+            ) = DRIVE_MOVE_LAYOUT.unpack(data)
+            return dict(
+                type="drive",
+                action="move",
+                args=dict(
+                    left_orientation=left_orientation.decode(),
+                    left_speed=left_speed,
+                    right_orientation=right_orientation.decode(),
+                    right_speed=right_speed,
+                    duration=None if duration == NO_DURATION else duration,
+                    distance=optional_float(distance),
+                    rotation=optional_float(rotation),
+                    auto_stop=auto_stop,
+                ),
+            )
+        elif message_id == DRIVE_STOP:
+            DRIVE_STOP_LAYOUT.unpack(data)
+            return dict(type="drive", action="stop", args={})
+        elif message_id == CAMERA_SET_POSITION:
+            _, position = CAMERA_SET_POSITION_LAYOUT.unpack(data)
+            return dict(type="camera", action="set_position", args=dict(position=position))
+    except struct.error as e:
+        raise BinaryProtocolError(f"Invalid message {message_id}: {e}")
+    raise BinaryProtocolError(f"Unknown message {message_id}")
+
+
+def encode_message(topic, message):
+    # Binary encoding of a message sent to the client, None if the message has no binary layout
+    if topic == "camera_status":
+        camera_status = message
+        return CAMERA_STATUS_LAYOUT.pack(
+            CAMERA_STATUS,
+            camera_status["status"].encode(),
+            camera_status["streaming"],
+            camera_status["overlay"],
+            camera_status["selected_camera"][0].encode(),
+            int(camera_status["position"]),
+            int(camera_status["center_position"]),
+        )
+    return None
@@ -0,0 +1,113 @@
+import asyncio
+import functools
+import logging
+import time
+
+from camera import Camera
+from video.encoder import DEFAULT_TIER
+
+logger = logging.getLogger(__name__)
+
+
+class LatestFrameSlot(object):
+    # Holds the latest encoded frame for one consumer. Only accessed from the event loop, a frame not taken before the
+    # next one arrives is dropped.
+
+    def __init__(self, name, tier):
+        self.name = name
+        self.tier = tier
+        self.frame = None
+        self.enqueued_ts = None
+        self.last_sequence = -1
+        # Adaptive quality controller of the consumer, if any
+        self.controller = None
+        self.new_frame = asyncio.Event()
+        self.nb_of_sent_frames = 0
+        self.nb_of_dropped_frames = 0
+
+    def put(self, encoded_frame):
+        # Frames of the previous tier may arrive after a tier change, never go back in time
+        if encoded_frame.sequence <= self.last_sequence:
+            return
+        self.last_sequence = encoded_frame.sequence
+        if self.frame is not None:
+            self.nb_of_dropped_frames += 1
+        self.frame = encoded_frame
+        self.enqueued_ts = time.time()
+        self.new_frame.set()
+
+    async def wait(self):
+        await self.new_frame.wait()
+
+    def take(self):
+        encoded_frame = self.frame
+        self.frame = None
+        self.new_frame.clear()
+        return encoded_frame
+
+    def serialize(self):
+        return {
+            'tier': self.tier,
+            'sent_frames': self.nb_of_sent_frames,
+            'dropped_frames': self.nb_of_dropped_frames,
+            'adaptive': self.controller.serialize() if self.controller is not None else None,
+        }
+
+
+class FrameBroadcaster(object):
+    # Hands encoded frames from the encoder threads to the event loop, the encoder never waits on network I/O
+    loop = None
+    slots = {}
+
+    @staticmethod
+    def setup(loop):
+        FrameBroadcaster.loop = loop
+
+    @staticmethod
+    def subscribe(name, tier=DEFAULT_TIER):
+        FrameBroadcaster.unsubscribe(name)
+        slot = LatestFrameSlot(name, tier)
+        FrameBroadcaster.slots[name] = slot
+        Camera.add_new_streaming_frame_callback(name, functools.partial(FrameBroadcaster.publish, slot), tier)
+        return slot
+
+    @staticmethod
+    def set_tier(name, tier):
+        # Move a consumer to another tier, keeping its slot
+        slot = FrameBroadcaster.slots.get(name)
+        if slot is not None and slot.tier != tier:
+            slot.tier = tier
+            Camera.add_new_streaming_frame_callback(name, functools.partial(FrameBroadcaster.publish, slot), tier)
+
+    @staticmethod
+    def unsubscribe(name):
+        Camera.remove_new_streaming_frame_callback(name)
+        slot = FrameBroadcaster.slots.pop(name, None)
+        if slot is not None:
+            logger.info(
+                f"Video consumer {name}: {slot.nb_of_sent_frames} frames sent, {slot.nb_of_dropped_frames} dropped"
+            )
+        return slot
+
+    @staticmethod
+    async def next_frame(tier=DEFAULT_TIER, timeout=None):
+        # Wait for the next frame encoded for the tier, None on timeout
+        name = f"next_frame_{id(asyncio.current_task())}"
+        slot = FrameBroadcaster.subscribe(name, tier)
+        try:
+            await asyncio.wait_for(slot.wait(), timeout=timeout)
+            return slot.take()
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            FrameBroadcaster.unsubscribe(name)
+
+    @staticmethod
+    def publish(slot, encoded_frame):
+        # Called from the encoder threads
+        if FrameBroadcaster.loop is not None and not FrameBroadcaster.loop.is_closed():
+            FrameBroadcaster.loop.call_soon_threadsafe(slot.put, encoded_frame)
+
+    @staticmethod
+    def serialize():
+        return {name: slot.serialize() for name, slot in FrameBroadcaster.slots.items()}
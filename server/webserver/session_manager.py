@@ -1,12 +1,19 @@
 from abc import ABC, abstractmethod
 import asyncio
+import collections
 import json
 import logging
-import threading
+import struct
 import time
 
 from camera import Camera
 from server import Server
+from models import Config
+from video.encoder import DEFAULT_TIER
+from video.stats import latency_stats
+from webserver.adaptive import AdaptiveStreamController
+from webserver.binary_protocol import PROTOCOL_VERSION, BinaryProtocolError, decode_message
+from webserver.broadcaster import FrameBroadcaster
 
 logger = logging.getLogger(__name__)
 
@@ -35,41 +42,190 @@ class RobotSessionManager(SessionManager):
         self.protocol = protocol
 
     async def process_message(self, message):
+        if isinstance(message, bytes):
+            # Binary encoding of a robot message, see binary_protocol
+            try:
+                robot_message = decode_message(message)
+            except BinaryProtocolError as e:
+                logger.warning(f"Invalid binary message: {e}")
+                return
+            await Server.process(robot_message, self.protocol)
+            return
         message_dict = json.loads(message)
         topic = message_dict.get("topic")
         if topic == "robot":
             await Server.process(message_dict.get("message"), self.protocol)
+        elif topic == "protocol":
+            # The client asks for the binary encoding of the frequent messages
+            self.protocol.binary = bool(message_dict.get("message", {}).get("binary", False))
+            await self.protocol.send_message("protocol", dict(binary=self.protocol.binary, version=PROTOCOL_VERSION))
         else:
             logger.warning(f"Unknown topic {topic}")
 
 
 class VideoSessionManager(SessionManager):
-    # Used for video streaming
+    # Used for video streaming. The client starts the stream with "start", or with a JSON message with the stream
+    # options: {"action": "start", "telemetry": true, "header": true}. With telemetry, each frame is preceded by a JSON
+    # text message with the data to draw the HUD, when the server does not draw it. With header, each frame starts with
+    # FRAME_HEADER: the sequence and the capture timestamp of the frame.
+    # The client sends "ready" when it received a frame, or a JSON message to report the latency: {"action": "ready",
+    # "sequence": <received frame>, "displayed": {"sequence", "received_ts", "display_ts"}} where displayed is the
+    # previous frame, with the times it was received and displayed by the client.
+    # Unless disabled in the config or with "adaptive": false in the start options, the tier and the frame rate of the
+    # session follow the backpressure of the client.
+    # The client can zoom on a region of interest, cropped and scaled before encoding: {"action": "roi", "crop": [x, y,
+    # width, height], "size": [width, height]} with the crop in % of the frame and the optional output size in pixels.
+    # Without crop, the session gets the full frame again. The crop and the size can also be set in the start options.
     NEW_FRAME_TIMEOUT = 2
+    FRAME_HEADER = struct.Struct("<Id")
+    # Number of sent frames kept to compute their latency when the client acknowledges them
+    MAX_SENT_FRAMES = 16
 
     def __init__(self, sid, ws):
         super().__init__(sid)
         self.ws = ws
-        self.client_ready = threading.Event()
+        self.client_ready = asyncio.Event()
         self.connection_opened = True
+        self.frame_slot = None
+        self.sender_task = None
+        self.telemetry = False
+        self.header = False
+        self.controller = None
+        # Region of interest requested by the client: (crop, size), and the tier encoding it
+        self.roi = None
+        self.roi_tier = None
+        # sequence -> [capture timestamp, send timestamp, round trip]
+        self.sent_frames = collections.OrderedDict()
+
+    @property
+    def name(self):
+        return f"session_{self.sid}"
 
     def close(self):
         if self.connection_opened:
-            Camera.remove_new_streaming_frame_callback(f"session_{self.sid}")
+            FrameBroadcaster.unsubscribe(self.name)
+            if self.roi_tier is not None:
+                Camera.encoder.remove_roi_tier(self.roi_tier)
+                self.roi_tier = None
+            if self.sender_task is not None:
+                self.sender_task.cancel()
             self.connection_opened = False
 
     async def process_message(self, message):
+        options = {}
+        if message.startswith("{"):
+            try:
+                options = json.loads(message)
+            except ValueError:
+                logger.warning(f"Invalid video message [{self.sid}]: {message[:100]}")
+                return
+            message = options.get("action")
         if message == "start":
-            Camera.add_new_streaming_frame_callback(f"session_{self.sid}", self.send_new_frame)
+            self.telemetry = options.get("telemetry", False)
+            self.header = options.get("header", False)
+            if self.frame_slot is None:
+                self.frame_slot = FrameBroadcaster.subscribe(self.name)
+                if options.get("adaptive", True) and Config.get("video_adaptive_streaming"):
+                    self.controller = AdaptiveStreamController(Camera.encoder.get_configured_tiers())
+                    self.frame_slot.controller = self.controller
+                self.sender_task = asyncio.ensure_future(self.send_frames())
+            if options.get("crop") is not None:
+                self.set_roi(options["crop"], options.get("size"))
             Camera.start_streaming()
+        elif message == "roi":
+            self.set_roi(options.get("crop"), options.get("size"))
         elif message == "ready":
+            if self.controller is not None and not self.client_ready.is_set():
+                self.controller.frame_acknowledged(time.time() - self.last_frame_ts)
+            self.frame_acknowledged(options.get("sequence"), options.get("displayed"))
             self.client_ready.set()
 
-    def send_new_frame(self, frame):
-        if self.connection_opened:
-            now = time.time()
-            if self.client_ready.is_set() or (now - self.last_frame_ts) > VideoSessionManager.NEW_FRAME_TIMEOUT:
-                self.last_frame_ts = now
-                asyncio.run(self.ws.send_bytes(frame))
+    async def send_frames(self):
+        try:
+            while self.connection_opened:
+                await self.frame_slot.wait()
+                # Wait for the client to be ready, newer frames replace the pending one in the meantime
+                nb_of_dropped_frames = self.frame_slot.nb_of_dropped_frames
+                timeout = self.last_frame_ts + VideoSessionManager.NEW_FRAME_TIMEOUT - time.time()
+                if not self.client_ready.is_set() and timeout > 0:
+                    try:
+                        await asyncio.wait_for(self.client_ready.wait(), timeout=timeout)
+                    except asyncio.TimeoutError:
+                        if self.controller is not None:
+                            self.controller.frame_acknowledged(VideoSessionManager.NEW_FRAME_TIMEOUT)
+                if self.controller is not None:
+                    self.controller.frames_dropped(self.frame_slot.nb_of_dropped_frames - nb_of_dropped_frames)
+                enqueued_ts = self.frame_slot.enqueued_ts
+                encoded_frame = self.frame_slot.take()
+                if encoded_frame is None:
+                    continue
                 self.client_ready.clear()
-
+                self.last_frame_ts = time.time()
+                if self.telemetry and encoded_frame.telemetry is not None:
+                    await self.ws.send_str(json.dumps(dict(type="telemetry", **encoded_frame.telemetry)))
+                data = encoded_frame.data
+                if self.header:
+                    data = VideoSessionManager.FRAME_HEADER.pack(encoded_frame.sequence, encoded_frame.timestamp) + data
+                await self.ws.send_bytes(data)
+                self.frame_sent(encoded_frame, enqueued_ts, time.time())
+                self.frame_slot.nb_of_sent_frames += 1
+                if self.controller is not None:
+                    self.controller.frame_sent()
+                    if self.controller.update():
+                        self.update_tier()
+                    if self.controller.max_fps is not None:
+                        # Frames captured in the meantime are dropped
+                        await asyncio.sleep(max(0.0, self.last_frame_ts + 1 / self.controller.max_fps - time.time()))
+        except asyncio.CancelledError:
+            pass
+        except ConnectionResetError:
+            logger.info(f"Video socket closed [{self.sid}]")
+
+    def set_roi(self, crop, size):
+        self.roi = (crop, size) if crop is not None else None
+        if self.frame_slot is not None:
+            self.update_tier()
+
+    def update_tier(self):
+        # The tier of the adaptive level, or the region of interest at the quality of this tier
+        tier_name = self.controller.tier if self.controller is not None else DEFAULT_TIER
+        roi_tier = None
+        if self.roi is not None:
+            crop, size = self.roi
+            quality = Camera.encoder.tiers.get(tier_name, Camera.encoder.tiers[DEFAULT_TIER]).quality
+            try:
+                roi_tier = Camera.encoder.add_roi_tier(crop, size, quality)
+            except (TypeError, ValueError):
+                logger.warning(f"Invalid region of interest {self.roi}")
+                self.roi = None
+        FrameBroadcaster.set_tier(self.name, roi_tier or tier_name)
+        if self.roi_tier is not None:
+            Camera.encoder.remove_roi_tier(self.roi_tier)
+        self.roi_tier = roi_tier
+
+    def frame_sent(self, encoded_frame, enqueued_ts, send_ts):
+        # Age of the frame at each stage, from its capture
+        for stage, timestamp in encoded_frame.stamps.items():
+            latency_stats.record(stage, timestamp - encoded_frame.timestamp)
+        if enqueued_ts is not None:
+            latency_stats.record("enqueue", enqueued_ts - encoded_frame.timestamp)
+        latency_stats.record("send", send_ts - encoded_frame.timestamp)
+        self.sent_frames[encoded_frame.sequence] = [encoded_frame.timestamp, send_ts, None]
+        while len(self.sent_frames) > VideoSessionManager.MAX_SENT_FRAMES:
+            self.sent_frames.popitem(last=False)
+
+    def frame_acknowledged(self, sequence, displayed):
+        now = time.time()
+        sent_frame = self.sent_frames.get(sequence)
+        if sent_frame is not None:
+            capture_ts, send_ts, _ = sent_frame
+            latency_stats.record("ack", now - capture_ts)
+            sent_frame[2] = now - send_ts
+        # The clocks of the client and the server differ: the display latency is the server side latency, plus half the
+        # round trip for the network, plus the time the client took to display the frame
+        if displayed is not None:
+            sent_frame = self.sent_frames.get(displayed.get("sequence"))
+            if sent_frame is not None and sent_frame[2] is not None:
+                capture_ts, send_ts, round_trip = sent_frame
+                display_delay = displayed["display_ts"] - displayed["received_ts"]
+                latency_stats.record("display", send_ts - capture_ts + round_trip / 2 + display_delay)